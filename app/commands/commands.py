@@ -15,6 +15,7 @@ from app import constants, settings
 from app.commands.registrator import CommandRegistrator
 from app.constants import DEFAULT_LOCALE
 from app.context import CallbackContext
+from app.database import Reporter
 from app.parsers.base import Parser
 from app.utils import a, b
 from app.utils.i18n import _
@@ -39,7 +40,9 @@ def start_text() -> str:
 
 @commands.add(description=_("Start using the bot"))
 async def start(update: Update, ctx: CallbackContext) -> None:
-    __ = ctx
+    reports = [r for r in await Reporter.from_context(ctx) if r]
+    if reports:
+        logger.info("Saved reports from start: %r", reports)
     await update.message.reply_html(_("{}\n\nUse /{} to get more information.").format(start_text(), HELP_COMMAND_NAME))
 
 
@@ -142,7 +145,7 @@ async def help_command(update: Update, ctx: CallbackContext) -> None:
 
 @commands.add(description=_("Clear your history from inline queries."))
 async def clear_history(update: Update, ctx: CallbackContext) -> None:
-    ctx.history = []
+    ctx.history.clear()
     await update.message.reply_text(_("History cleared."))
 
 
@@ -1 +1,2 @@
 from app.context.callback_context import *
+from app.context.history import *
@@ -5,7 +5,8 @@ from telegram.constants import ChatType
 from telegram.ext import Application, ExtBot
 from telegram.ext import CallbackContext as CallbackContextBase
 
-from app.constants import DEFAULT_LOCALE, Keys
+from app.constants import DEFAULT_LOCALE, HISTORY_MAX_LENGTH, Keys
+from app.context.history import History
 
 _SET_DEFAULT = TypeVar("_SET_DEFAULT", bound=Any)
 
@@ -74,12 +75,10 @@ class CallbackContext(CallbackContextBase[ExtBot, dict, dict, dict]):
         self.settings: ContextSettings = ContextSettings(self)
 
     @property
-    def history(self) -> list:
-        return self.user_data.setdefault(Keys.HISTORY.value, [])
-
-    @history.setter
-    def history(self, value: list) -> None:
-        self.user_data[Keys.HISTORY.value] = value
+    def history(self) -> History:
+        # Old history was a list of media dicts in the key of the history setting
+        History.migrate(self.user_data, "inline_history", Keys.HISTORY.value, HISTORY_MAX_LENGTH)
+        return History(self.user_data.setdefault("inline_history", {}), HISTORY_MAX_LENGTH)
 
     @property
     def temp_history(self) -> dict:
@@ -121,11 +120,3 @@ class CallbackContext(CallbackContextBase[ExtBot, dict, dict, dict]):
     @media_cache.setter
     def media_cache(self, value: dict[str, dict]) -> None:
         self.bot_data["media_cache"] = value
-
-    @property
-    def tg_video_cache(self) -> dict[str, dict]:
-        return self.bot_data.setdefault("tg_video_cache", {})
-
-    @tg_video_cache.setter
-    def tg_video_cache(self, value: dict[str, dict]) -> None:
-        self.bot_data["tg_video_cache"] = value
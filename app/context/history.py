@@ -0,0 +1,71 @@
+import hashlib
+import time
+from collections.abc import Iterator
+
+__all__ = ("History",)
+
+
+class History:
+    """Media recently sent by the user from inline queries.
+
+    It's saved in `user_data` as a dict `{url hash: [original_url, timestamp, info]}`
+    (the most recent is the last), so adding a URL again only moves it to the end.
+    Media is resolved by the original URL from the media cache. `info` has only texts of the media
+    (not expiring URLs), so the video can be sent by its Telegram file id after the media is expired.
+    """
+
+    # Fields of the media dict, that are kept in the history
+    INFO_FIELDS = ("@type", "type", "caption", "author", "extra_description", "language")
+
+    def __init__(self, data: dict[str, list], max_length: int) -> None:
+        self._data = data
+        self.max_length = max_length
+
+    @staticmethod
+    def _key(original_url: str) -> str:
+        # URLs can't be keys of MongoDB documents (they have dots)
+        return hashlib.sha1(original_url.encode()).hexdigest()[:16]
+
+    def add(self, original_url: str, media: dict | None = None) -> None:
+        key = self._key(original_url)
+        self._data.pop(key, None)
+        info = {k: media[k] for k in self.INFO_FIELDS if media and media.get(k) is not None}
+        self._data[key] = [original_url, int(time.time()), info]
+        while len(self._data) > self.max_length:
+            del self._data[next(iter(self._data))]
+
+    def remove(self, original_url: str) -> None:
+        self._data.pop(self._key(original_url), None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def urls(self) -> list[str]:
+        """Original URLs, the most recent first."""
+        return [entry[0] for entry in reversed(self._data.values())]
+
+    def info(self, original_url: str) -> dict:
+        """Texts of the media, saved when it was added. Empty for old entries."""
+        entry = self._data.get(self._key(original_url))
+        return entry[2] if entry and len(entry) > 2 else {}
+
+    def __contains__(self, original_url: str) -> bool:
+        return self._key(original_url) in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.urls())
+
+    @classmethod
+    def migrate(cls, user_data: dict, key: str, old_key: str, max_length: int) -> None:
+        """Move the old history (list of media dicts, the most recent is the last) to the new format."""
+        old = user_data.get(old_key)
+        if not isinstance(old, list):
+            return None
+        del user_data[old_key]
+        history = cls(user_data.setdefault(key, {}), max_length)
+        for media in old:
+            if isinstance(media, dict) and media.get("original_url"):
+                history.add(media["original_url"], media)
@@ -1,2 +1,19 @@
-from app.database.media_cache import MediaCache
-from app.database.reporter import Reporter
+from app import constants
+from app.database.negative_cache import NegativeCache
+from app.database.short_links import ShortLinkCache
+from app.database.storage_uploader import StorageUploader
+from app.database.telegram_files import TelegramFileCache
+from app.database.url_alias import UrlAlias
+
+# Media cache, reports and user data are in the selected storage.
+# Other caches are in MongoDB, and only in memory without it
+if constants.STORAGE_BACKEND == "sqlite":
+    from app.database.sqlite import SQLiteDatabase as Database
+    from app.database.sqlite import SQLiteMediaCache as MediaCache
+    from app.database.sqlite import SQLitePersistence as Persistence
+    from app.database.sqlite import SQLiteReporter as Reporter
+else:
+    from app.database.connector import MongoDatabase as Database
+    from app.database.media_cache import MediaCache
+    from app.database.persistence import MongoPersistence as Persistence
+    from app.database.reporter import Reporter
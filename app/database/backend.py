@@ -0,0 +1,81 @@
+import asyncio
+import secrets
+from typing import Protocol
+
+from app.context import CallbackContext
+from app.models.medias import Media
+from app.models.report import Report
+from app.utils.cache import TTLCache
+
+
+class Database(Protocol):
+    """Connection to the storage, opened in `post_init` and closed in `post_shutdown`."""
+
+    @classmethod
+    async def init(cls) -> None: ...
+
+    @classmethod
+    def close(cls) -> None: ...
+
+
+class MediaCacheBackend(Protocol):
+    """Parsed media by the original URL."""
+
+    @classmethod
+    async def get_medias(cls, original_url: str) -> list[Media] | None: ...
+
+    @classmethod
+    async def get_many(cls, original_urls: list[str]) -> dict[str, list[Media]]: ...
+
+    @classmethod
+    async def save_medias(cls, *medias: Media) -> str | None: ...
+
+    @classmethod
+    async def update_medias(cls, original_url: str, *medias: Media) -> None: ...
+
+    @classmethod
+    async def delete_media(cls, original_url: str) -> None: ...
+
+    @classmethod
+    async def flush(cls, wait: bool = False) -> None: ...
+
+
+# Reports are removed after 30 minutes
+REPORT_TTL = 30 * 60
+
+
+class ReporterBase:
+    """Reports of users. Storages implement `save_report` and `find_report`.
+
+    Report is saved under the id from `defer_report`, so the same report link can be opened many times.
+    """
+
+    # Reports that are saved only when the user opens the report link
+    pending: TTLCache[str, Report] = TTLCache(ttl=REPORT_TTL, max_items=100_000)
+
+    @classmethod
+    def defer_report(cls, report: Report) -> str:
+        """Keep the report in memory and return its id for `/start report_<id>`."""
+        report_id = secrets.token_urlsafe(12)
+        cls.pending.set(report_id, report)
+        return report_id
+
+    @classmethod
+    async def get_report(cls, report_id: str) -> Report | None:
+        report = cls.pending.pop(report_id)
+        if report is not None:
+            await cls.save_report(report, report_id)
+            return report
+        return await cls.find_report(report_id)
+
+    @classmethod
+    async def save_report(cls, report: Report, report_id: str | None = None) -> str | None:
+        raise NotImplementedError
+
+    @classmethod
+    async def find_report(cls, report_id: str) -> Report | None:
+        raise NotImplementedError
+
+    @classmethod
+    async def from_context(cls, ctx: CallbackContext) -> list[Report]:
+        return await asyncio.gather(*(cls.get_report(arg[7:]) for arg in (ctx.args or []) if arg.startswith("report_")))
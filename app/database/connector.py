@@ -1,39 +1,107 @@
+import asyncio
+import logging
+from typing import ClassVar
+
 from motor.motor_asyncio import AsyncIOMotorClient as Client
 from motor.motor_asyncio import AsyncIOMotorCollection as Collection
 from motor.motor_asyncio import AsyncIOMotorDatabase as Database
-from pymongo.errors import CollectionInvalid
+from pymongo import IndexModel
+from pymongo.errors import CollectionInvalid, PyMongoError
 
 from app import constants
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 _client: Client | None = None
 _db: Database | None = None
 
 
 class MongoDatabase:
+    # Collection and indexes are created (or updated) once in `init`
+    COLLECTION: ClassVar[str | None] = None
+    INDEXES: ClassVar[list[IndexModel]] = []
+
     _client: Client | None = None
     _db: Database | None = None
     _collection: Collection | None = None
+    # Writes, that are not awaited by the callers
+    _write_tasks: ClassVar[set[asyncio.Task]] = set()
 
     @classmethod
-    def init(cls) -> None:
+    async def init(cls) -> None:
+        if cls._client is not None or not constants.ENABLE_MONGO:
+            return None
         cls._client = Client(constants.MONGO_URL)
         cls._db = cls._client.get_database(constants.MONGO_DB)
         for sub_cls in cls.__subclasses__():
             sub_cls._client = cls._client
             sub_cls._db = cls._db
+            await sub_cls._setup()
 
     @classmethod
     def close(cls) -> None:
-        cls._client.close()
+        if cls._client is not None:
+            cls._client.close()
+            cls._client = None
+
+    @classmethod
+    async def col(cls) -> Collection | None:
+        return cls._collection
+
+    @classmethod
+    def write_in_background(cls, operations: list) -> None:
+        """Save `operations` with one `bulk_write` without waiting for it. Failed writes are only logged."""
+        if cls._collection is None or not operations:
+            return None
+        task = asyncio.create_task(cls._bulk_write(cls._collection, operations))
+        MongoDatabase._write_tasks.add(task)
+        task.add_done_callback(MongoDatabase._write_tasks.discard)
 
     @classmethod
-    async def _get_col(cls, name: str) -> Collection | None:
-        if cls._collection is not None:
-            return cls._collection
+    async def _bulk_write(cls, col: Collection, operations: list) -> None:
         try:
-            cls._collection = await cls._db.create_collection(name)
+            with metrics.timer(f"{cls.COLLECTION}.write"):
+                await col.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            metrics.incr(f"{cls.COLLECTION}.write_failed")
+            logger.warning("Failed to save %d document(s) to %s", len(operations), cls.COLLECTION, exc_info=e)
+
+    @classmethod
+    async def wait_writes(cls) -> None:
+        """Wait for the writes started by `write_in_background`."""
+        if MongoDatabase._write_tasks:
+            await asyncio.gather(*MongoDatabase._write_tasks, return_exceptions=True)
+
+    @classmethod
+    async def _setup(cls) -> None:
+        if not cls.COLLECTION:
+            return None
+        name = cls.COLLECTION
+        try:
+            col = await cls._db.create_collection(name)
         except CollectionInvalid as e:
             if e.args[0] != f"collection {name} already exists":
                 raise e
-            cls._collection = cls._db.get_collection(name)
-        return cls._collection
+            col = cls._db.get_collection(name)
+        await cls._setup_indexes(col)
+        cls._collection = col
+
+    @classmethod
+    async def _setup_indexes(cls, col: Collection) -> None:
+        if not cls.INDEXES:
+            return None
+        existing: dict[str, dict] = await col.index_information()
+        for index in cls.INDEXES:
+            spec = index.document
+            old = existing.get(spec["name"])
+            if old is None:
+                continue
+            if list(old["key"]) == list(spec["key"].items()) and old.get("expireAfterSeconds") == spec.get(
+                "expireAfterSeconds"
+            ):
+                continue
+            # Index options are changed, so it must be created again
+            logger.info("Dropping outdated index %s.%s", cls.COLLECTION, spec["name"])
+            await col.drop_index(spec["name"])
+        await col.create_indexes(cls.INDEXES)
@@ -1,91 +1,208 @@
+import asyncio
+import json
+import logging
 from datetime import datetime
 
 import pytz
 from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from pymongo import IndexModel, UpdateOne
+from pymongo.errors import PyMongoError
 
+from app import constants
 from app.database.connector import MongoDatabase
 from app.models.medias import Media
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _content_size(content: list[dict]) -> int:
+    return len(json.dumps(content, default=str))
+
+
+def _expires_at(medias: list[Media]) -> datetime | None:
+    return min((m.expires_at for m in medias if m.expires_at), default=None)
 
 
 class MediaCache(MongoDatabase):
+    COLLECTION = "media_cache"
+    INDEXES = [
+        # Documents with expired media URLs are removed by MongoDB
+        IndexModel("expires_at", expireAfterSeconds=0, name="expires_at_ttl"),
+    ]
     _collection: Collection | None = None
+    # In-memory tier in front of the collection: original_url -> (medias, serialized size)
+    memory: TTLCache[str, tuple[list[Media], int]] = TTLCache(
+        ttl=constants.MEDIA_CACHE_TTL,
+        max_bytes=constants.MEDIA_CACHE_MAX_BYTES,
+        sizeof=lambda item: item[1],
+    )
+    # Write-behind queue: original_url -> upsert operation
+    _pending: dict[str, UpdateOne] = {}
+    _flush_timer: asyncio.TimerHandle | None = None
+    _flush_tasks: set[asyncio.Task] = set()
 
     @classmethod
-    async def col(cls) -> Collection | None:
-        if cls._db is None:
-            return None
+    def _remember(cls, original_url: str, medias: list[Media], content: list[dict]) -> None:
+        ttl = constants.MEDIA_CACHE_TTL
+        expires_at = _expires_at(medias)
+        if expires_at is not None:
+            ttl = min(ttl, (expires_at - datetime.now(tz=pytz.UTC)).total_seconds())
+        cls.memory.set(original_url, (medias, _content_size(content)), ttl=ttl)
 
-        name = "media_cache"
+    @classmethod
+    def _not_expired(cls) -> dict:
+        # Signed URLs of expired media don't work anymore
+        return {"$or": [{"expires_at": None}, {"expires_at": {"$gt": datetime.now(tz=pytz.UTC)}}]}
 
-        return await cls._get_col(name)
+    @classmethod
+    def _from_document(cls, data: dict) -> list[Media] | None:
+        original_url = data["_id"]
+        content = data.get("content", [])
+        medias = [Media.from_dict(dict(i)) for i in content]
+        if any(m.is_expired() for m in medias):
+            return None
+        if medias:
+            cls._remember(original_url, medias, content)
+        return [m.copy() for m in medias]
 
     @classmethod
     async def get_medias(cls, original_url: str) -> list[Media] | None:
+        cached = cls.memory.get(original_url)
+        if cached is not None:
+            return [m.copy() for m in cached[0]]
+
         col = await cls.col()
         if col is None:
             return None
 
-        data = await col.find_one({"_id": original_url})
+        data = await col.find_one({"_id": original_url, **cls._not_expired()})
         if not data:
             return None
-        d = dict(data)
-        d.pop("_id", None)
-        d.pop("created_at", None)
-        d.pop("updated_at", None)
-        return [Media.from_dict(i) for i in d.get("content", [])]
+        return cls._from_document(data)
+
+    @classmethod
+    async def get_many(cls, original_urls: list[str]) -> dict[str, list[Media]]:
+        """Medias by original URL. Not found media is missing in the result. The database is queried once."""
+        found: dict[str, list[Media]] = {}
+        to_find: list[str] = []
+        for url in dict.fromkeys(original_urls):
+            cached = cls.memory.get(url)
+            if cached is not None:
+                found[url] = [m.copy() for m in cached[0]]
+            else:
+                to_find.append(url)
+
+        col = await cls.col()
+        if not to_find or col is None:
+            return found
+        async for data in col.find({"_id": {"$in": to_find}, **cls._not_expired()}):
+            medias = cls._from_document(data)
+            if medias:
+                found[data["_id"]] = medias
+        return found
 
     @classmethod
     async def save_medias(cls, *medias: Media) -> str | None:
         if not medias:
             return None
 
-        col: Collection = await cls.col()
-        if col is None:
-            return None
-
-        now = datetime.now(tz=pytz.UTC)
         url = medias[0].original_url
         data = [m.to_dict() for m in medias]
+        cls._remember(url, [m.copy() for m in medias], data)
+
+        if cls._db is None:
+            return None
 
-        old = await col.find_one({"_id": url})
-        print("save_medias", url, old)
-        if old:
-            res = await col.update_one(
-                {"_id": url},
-                {
-                    "$set": {
-                        "content": old.get("data", []) + data,
-                        "updated_at": now,
-                    }
+        now = datetime.now(tz=pytz.UTC)
+        operation = UpdateOne(
+            {"_id": url},
+            {
+                "$set": {
+                    "content": data,
+                    "updated_at": now,
+                    "expires_at": _expires_at(list(medias)),
                 },
+                "$setOnInsert": {"created_at": now},
+            },
+            upsert=True,
+        )
+        if constants.MEDIA_CACHE_WRITE_BEHIND:
+            cls._enqueue(url, operation)
+            return url
+
+        col = await cls.col()
+        await col.bulk_write([operation])
+        return url
+
+    @classmethod
+    def _enqueue(cls, url: str, operation: UpdateOne) -> None:
+        # Only the last write for the same URL is saved
+        cls._pending[url] = operation
+        if len(cls._pending) >= constants.MEDIA_CACHE_WRITE_BATCH_SIZE:
+            cls._start_flush()
+        elif cls._flush_timer is None:
+            cls._flush_timer = asyncio.get_running_loop().call_later(
+                constants.MEDIA_CACHE_WRITE_INTERVAL,
+                cls._start_flush,
             )
+
+    @classmethod
+    def _start_flush(cls) -> None:
+        task = asyncio.create_task(cls.flush())
+        cls._flush_tasks.add(task)
+        task.add_done_callback(cls._flush_tasks.discard)
+
+    @classmethod
+    async def flush(cls, wait: bool = False) -> None:
+        """Save pending writes to the database. With `wait`, also wait for the writes already in progress."""
+        if cls._flush_timer is not None:
+            cls._flush_timer.cancel()
+            cls._flush_timer = None
+        if wait and cls._flush_tasks:
+            await asyncio.gather(*cls._flush_tasks, return_exceptions=True)
+        if not cls._pending:
+            return None
+        operations = list(cls._pending.values())
+        cls._pending.clear()
+
+        col = await cls.col()
+        if col is None:
+            return None
+        try:
+            with metrics.timer("media_cache.flush"):
+                await col.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            logger.error("Failed to save %d media(s) to cache", len(operations), exc_info=e)
         else:
-            res = await col.insert_one(
-                {
-                    "_id": url,
-                    "created_at": now,
-                    "updated_at": now,
-                    "content": data,
-                }
-            )
-        return str(res.inserted_id)
+            logger.info("Saved %d media(s) to cache", len(operations))
 
     @classmethod
     async def update_medias(cls, original_url: str, *medias: Media) -> None:
+        cls.memory.pop(original_url)
         if not cls._db:
             return None
         col = await cls.col()
         await col.update_one(
             {"_id": original_url},
             {
-                "content": [m.to_dict() for m in medias],
-                "updated_at": datetime.now(tz=pytz.UTC),
+                "$set": {
+                    "content": [m.to_dict() for m in medias],
+                    "updated_at": datetime.now(tz=pytz.UTC),
+                    "expires_at": _expires_at(list(medias)),
+                }
             },
         )
 
     @classmethod
     async def delete_media(cls, original_url: str) -> None:
+        cls.memory.pop(original_url)
+        cls._pending.pop(original_url, None)
         col = await cls.col()
         if col is None:
             return None
         await col.delete_one({"_id": original_url})
+
+
+metrics.gauge("media_cache.memory", MediaCache.memory.stats)
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytz
+from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from pymongo import IndexModel, UpdateOne
+
+from app.database.connector import MongoDatabase
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+
+class NegativeCache(MongoDatabase):
+    """Links that were resolved to no media, with the reason."""
+
+    COLLECTION = "media_not_found"
+    INDEXES = [
+        # Expired records are removed by MongoDB
+        IndexModel("expires_at", expireAfterSeconds=0, name="expires_at_ttl"),
+    ]
+    _collection: Collection | None = None
+    memory: TTLCache[str, str] = TTLCache(max_items=10_000)
+
+    @classmethod
+    async def get_reason(cls, key: str) -> str | None:
+        reason = cls.memory.get(key)
+        if reason is not None:
+            return reason
+
+        col = await cls.col()
+        if col is None:
+            return None
+
+        now = datetime.now(tz=pytz.UTC)
+        data = await col.find_one({"_id": key, "expires_at": {"$gt": now}})
+        if not data:
+            return None
+        ttl = (data["expires_at"].replace(tzinfo=pytz.UTC) - now).total_seconds()
+        cls.memory.set(key, data["reason"], ttl=ttl)
+        return data["reason"]
+
+    @classmethod
+    def save_reason(cls, reason: str, ttl: int, *keys: str) -> None:
+        """Remember the reason in memory, and save it to the database in background."""
+        keys = tuple(dict.fromkeys(filter(bool, keys)))
+        if not keys or ttl <= 0:
+            return None
+
+        for key in keys:
+            cls.memory.set(key, reason, ttl=ttl)
+
+        now = datetime.now(tz=pytz.UTC)
+        data = {"reason": reason, "created_at": now, "expires_at": now + timedelta(seconds=ttl)}
+        cls.write_in_background([UpdateOne({"_id": key}, {"$set": data}, upsert=True) for key in keys])
+
+
+metrics.gauge("media_not_found.memory", NegativeCache.memory.stats)
@@ -0,0 +1,409 @@
+import asyncio
+import copy
+import logging
+import time
+from abc import abstractmethod
+from collections.abc import Awaitable, Callable, Hashable
+from typing import ClassVar
+
+from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from telegram.ext import BasePersistence, PersistenceInput
+from telegram.ext._utils.types import CDCData, ConversationDict, ConversationKey
+
+from app.database.connector import MongoDatabase
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BOT_DATA_KEY = 0
+
+# Kinds of the data (names of the collections or tables)
+USER_DATA = "user-data"
+CHAT_DATA = "chat-data"
+BOT_DATA = "bot-data"
+CONVERSATIONS_DATA = "conversations-data"
+
+# (kind, id) -> update operation (`$set` and `$unset` of changed keys)
+Changes = dict[tuple[str, Hashable], dict[str, dict]]
+
+
+class UserDataCollection(MongoDatabase):
+    COLLECTION = USER_DATA
+    _collection: Collection | None = None
+
+
+class ChatDataCollection(MongoDatabase):
+    COLLECTION = CHAT_DATA
+    _collection: Collection | None = None
+
+
+class BotDataCollection(MongoDatabase):
+    COLLECTION = BOT_DATA
+    _collection: Collection | None = None
+
+
+class ConversationsCollection(MongoDatabase):
+    COLLECTION = CONVERSATIONS_DATA
+    _collection: Collection | None = None
+
+
+class _DataStore:
+    """Data of users (or chats) loaded on first access, with only changed keys saved to the database."""
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[str, Hashable], Awaitable[dict]],
+        ignore_keys: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self._loader = loader
+        self.ignore_keys = set(ignore_keys)
+        # id -> data saved in the database
+        self.saved: dict[Hashable, dict] = {}
+        # id -> live dict of the application, to free it when it's not used
+        self.live: dict[Hashable, dict] = {}
+        self.accessed: dict[Hashable, float] = {}
+        self._loading: dict[Hashable, asyncio.Future] = {}
+
+    def _clean(self, data: dict) -> dict:
+        return {k: v for k, v in data.items() if k not in self.ignore_keys}
+
+    async def load(self, id_: Hashable) -> dict:
+        metrics.incr(f"persistence.{self.name.replace('-', '_')}.load")
+        return self._clean(await self._loader(self.name, id_))
+
+    async def refresh(self, id_: Hashable, live: dict) -> None:
+        self.accessed[id_] = time.monotonic()
+        if id_ in self.saved:
+            self.live[id_] = live
+            return None
+
+        # Concurrent updates of the same user wait for one load
+        future = self._loading.get(id_)
+        if future is not None:
+            await asyncio.shield(future)
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[id_] = future
+        try:
+            data = await self.load(id_)
+            # Keys set before the data is loaded are newer
+            for key, value in copy.deepcopy(data).items():
+                live.setdefault(key, value)
+            self.saved[id_] = data
+            self.live[id_] = live
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            del self._loading[id_]
+
+    def diff(self, id_: Hashable, data: dict) -> dict[str, dict] | None:
+        """Update operation with only changed keys of the data."""
+        self.accessed[id_] = time.monotonic()
+        data = self._clean(data)
+        old = self.saved.get(id_, {})
+        to_set = {str(k): v for k, v in data.items() if k not in old or old[k] != v}
+        to_unset = {str(k): "" for k in old if k not in data}
+        self.saved[id_] = data
+        update = {}
+        if to_set:
+            update["$set"] = to_set
+        if to_unset:
+            update["$unset"] = to_unset
+        return update or None
+
+    def forget(self, id_: Hashable) -> None:
+        self.saved.pop(id_, None)
+        self.live.pop(id_, None)
+        self.accessed.pop(id_, None)
+
+    def evict(self, idle: float) -> int:
+        """Free data, that is saved and not used for `idle` seconds. It's loaded again on next access."""
+        deadline = time.monotonic() - idle
+        evicted = 0
+        for id_, accessed in list(self.accessed.items()):
+            if accessed > deadline or id_ in self._loading:
+                continue
+            live = self.live.get(id_)
+            if live is not None and self._clean(live) != self.saved.get(id_):
+                # Changes are not saved yet
+                continue
+            if live is not None:
+                live.clear()
+            self.forget(id_)
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict[str, int]:
+        return {"loaded": len(self.saved)}
+
+
+class LazyPersistence(BasePersistence[dict, dict, dict]):
+    """Persistence, that loads user and chat data on the first update of the user (or chat), not at startup.
+
+    Changed keys are saved in batches, and data of idle users is freed.
+    Subclasses only read, write and delete the data in the storage.
+    """
+
+    # Keys that are not saved to the database
+    USER_IGNORE_KEYS: ClassVar[tuple[str, ...]] = ("tmp_history",)
+    BATCH_SIZE: ClassVar[int] = 500
+    # Seconds to wait for more changes before the batch is saved
+    WRITE_INTERVAL: ClassVar[float] = 1
+    # Seconds to wait before changes, that failed to save, are saved again
+    RETRY_INTERVAL: ClassVar[float] = 10
+
+    def __init__(self, update_interval: float = 60, idle_ttl: float = 60 * 60) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.idle_ttl = idle_ttl
+        self.users = _DataStore(USER_DATA, self._load, self.USER_IGNORE_KEYS)
+        self.chats = _DataStore(CHAT_DATA, self._load)
+        self.bot_data: dict = {}
+        self.conversations: dict[str, ConversationDict] = {}
+        self._pending: Changes = {}
+        self._flush_timer: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        self._last_eviction = time.monotonic()
+
+        metrics.gauge("persistence.user_data", self.users.stats)
+        metrics.gauge("persistence.chat_data", self.chats.stats)
+
+    # region Storage
+    @abstractmethod
+    async def _init(self) -> None:
+        """Connect to the storage. Persistence is loaded before `post_init` of the application."""
+
+    @abstractmethod
+    async def _load(self, kind: str, id_: Hashable) -> dict:
+        """Data of the user, chat, bot (`BOT_DATA_KEY`) or conversation (by name)."""
+
+    @abstractmethod
+    async def _save(self, changes: Changes) -> Changes:
+        """Save the changes and return ones, that failed to save (they are saved again later)."""
+
+    @abstractmethod
+    async def _delete(self, kind: str, id_: Hashable) -> None:
+        pass
+
+    # endregion
+
+    # region Write batches
+    def _merge(self, key: tuple[str, Hashable], update: dict[str, dict]) -> None:
+        pending = self._pending.setdefault(key, {})
+        for op in ("$set", "$unset"):
+            other = "$unset" if op == "$set" else "$set"
+            for field, value in update.get(op, {}).items():
+                pending.setdefault(op, {})[field] = value
+                pending.get(other, {}).pop(field, None)
+        for op in ("$set", "$unset"):
+            if op in pending and not pending[op]:
+                del pending[op]
+
+    def _enqueue(self, kind: str, id_: Hashable, update: dict[str, dict]) -> None:
+        self._merge((kind, id_), update)
+        if len(self._pending) >= self.BATCH_SIZE:
+            self._start_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self.WRITE_INTERVAL, self._start_flush)
+
+    def _requeue(self, failed: Changes) -> None:
+        # Changes made after the failed write are newer
+        newer = self._pending
+        self._pending = {}
+        for key, update in (*failed.items(), *newer.items()):
+            self._merge(key, update)
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self.RETRY_INTERVAL, self._start_flush)
+
+    def _start_flush(self) -> None:
+        task = asyncio.create_task(self._write())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _write(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        changes = {key: update for key, update in self._pending.items() if update}
+        self._pending = {}
+        if not changes:
+            return None
+        with metrics.timer("persistence.write"):
+            try:
+                failed = await self._save(changes)
+            except Exception as e:
+                logger.error("Failed to save %d change(s)", len(changes), exc_info=e)
+                failed = changes
+        if failed:
+            metrics.incr("persistence.write_failed", len(failed))
+            self._requeue(failed)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        if now - self._last_eviction < min(self.idle_ttl, 60):
+            return None
+        self._last_eviction = now
+        evicted = self.users.evict(self.idle_ttl) + self.chats.evict(self.idle_ttl)
+        if evicted:
+            logger.info("Freed data of %d idle user(s) and chat(s)", evicted)
+
+    # endregion
+
+    # region User and chat data
+    async def get_user_data(self) -> dict[int, dict]:
+        await self._init()
+        return {}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        await self._init()
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self.users.refresh(user_id, user_data)
+        self._evict()
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self.chats.refresh(chat_id, chat_data)
+
+    async def _update_data(self, store: _DataStore, id_: int, data: dict) -> None:
+        if id_ not in store.saved:
+            # Data is changed, but it's not loaded: load it first, so other keys are not lost
+            data = {**await store.load(id_), **data}
+        update = store.diff(id_, data)
+        if update:
+            self._enqueue(store.name, id_, update)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._update_data(self.users, user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._update_data(self.chats, chat_id, data)
+
+    async def _drop_data(self, store: _DataStore, id_: int) -> None:
+        store.forget(id_)
+        self._pending.pop((store.name, id_), None)
+        await self._delete(store.name, id_)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._drop_data(self.users, user_id)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._drop_data(self.chats, chat_id)
+
+    # endregion
+
+    # region Bot data
+    async def get_bot_data(self) -> dict:
+        await self._init()
+        self.bot_data = await self._load(BOT_DATA, BOT_DATA_KEY)
+        return dict(self.bot_data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        changed = {str(k): v for k, v in data.items() if k not in self.bot_data or self.bot_data[k] != v}
+        removed = {str(k): "" for k in self.bot_data if k not in data}
+        self.bot_data = data
+        update: dict[str, dict] = {}
+        if changed:
+            update["$set"] = changed
+        if removed:
+            update["$unset"] = removed
+        if update:
+            self._enqueue(BOT_DATA, BOT_DATA_KEY, update)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # endregion
+
+    # region Conversations
+    async def get_conversations(self, name: str) -> ConversationDict:
+        await self._init()
+        conversations: ConversationDict = {}
+        for key, state in (await self._load(CONVERSATIONS_DATA, name)).items():
+            conversations[tuple(int(i) for i in key.strip("()").split(",") if i.strip())] = state
+        self.conversations[name] = conversations
+        return dict(conversations)
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: object | None) -> None:
+        conversations = self.conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return None
+        conversations[key] = new_state
+        self._enqueue(CONVERSATIONS_DATA, name, {"$set": {str(key): new_state}})
+
+    # endregion
+
+    # region Callback data (not stored)
+    async def get_callback_data(self) -> CDCData | None:
+        return None
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        pass
+
+    # endregion
+
+    async def flush(self) -> None:
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self._write()
+
+
+class MongoPersistence(LazyPersistence):
+    """Persistence for `user-data`, `chat-data`, `bot-data` and `conversations-data` collections.
+
+    Documents are `{"_id": id, **data}` (bot data is in `content` field), the same as in `mongopersistence`.
+    """
+
+    COLLECTIONS: ClassVar[dict[str, type[MongoDatabase]]] = {
+        USER_DATA: UserDataCollection,
+        CHAT_DATA: ChatDataCollection,
+        BOT_DATA: BotDataCollection,
+        CONVERSATIONS_DATA: ConversationsCollection,
+    }
+
+    async def _init(self) -> None:
+        await MongoDatabase.init()
+
+    async def _load(self, kind: str, id_: Hashable) -> dict:
+        col = await self.COLLECTIONS[kind].col()
+        doc = await col.find_one({"_id": id_}) if col is not None else None
+        if not doc:
+            return {}
+        if kind == BOT_DATA:
+            return dict(doc.get("content") or {})
+        doc.pop("_id", None)
+        return doc
+
+    async def _save(self, changes: Changes) -> Changes:
+        operations: dict[str, list[UpdateOne]] = {}
+        for (kind, id_), update in changes.items():
+            if kind == BOT_DATA:
+                update = {op: {f"content.{k}": v for k, v in fields.items()} for op, fields in update.items()}
+            operations.setdefault(kind, []).append(UpdateOne({"_id": id_}, update, upsert=True))
+        failed: Changes = {}
+        for kind, ops in operations.items():
+            col = await self.COLLECTIONS[kind].col()
+            try:
+                await col.bulk_write(ops, ordered=False)
+            except PyMongoError as e:
+                # Updates only set and unset keys, so saved documents of the batch can be updated again
+                logger.error("Failed to save %d document(s) to %s", len(ops), kind, exc_info=e)
+                failed.update({key: update for key, update in changes.items() if key[0] == kind})
+            else:
+                logger.debug("Saved %d document(s) to %s", len(ops), kind)
+        return failed
+
+    async def _delete(self, kind: str, id_: Hashable) -> None:
+        col = await self.COLLECTIONS[kind].col()
+        await col.delete_one({"_id": id_})
@@ -1,57 +1,34 @@
-import asyncio
 from datetime import datetime
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorCollection as Collection
-from pymongo.errors import OperationFailure
+from pymongo import IndexModel
 
-from app.context import CallbackContext
+from app.database.backend import REPORT_TTL, ReporterBase
 from app.database.connector import MongoDatabase
 from app.models.report import Report
 
 
-class Reporter(MongoDatabase):
+class Reporter(ReporterBase, MongoDatabase):
+    COLLECTION = "reports"
+    INDEXES = [
+        # Авто удаление старых записей (через 30 минут)
+        IndexModel("created_at", expireAfterSeconds=REPORT_TTL, name="created_at_ttl"),
+    ]
     _collection: Collection | None = None
 
-    @classmethod
-    async def col(cls) -> Collection | None:
-        if cls._db is None:
-            return None
-
-        name = "reports"
-        await cls._get_col(name)
-
-        # Авто удаление старых записей
-        index_name = "created_at_ttl"
-        expire_after_seconds = 1800  # 30 минут
-        try:
-            # Попытка создания индекса
-            await cls._collection.create_index(
-                "created_at",
-                expireAfterSeconds=expire_after_seconds,
-                name=index_name,
-            )
-        except OperationFailure as e:
-            # Если индекс уже существует, удаляем его и создаем новый
-            if e.code == 85:
-                await cls._collection.drop_index(index_name)
-                await cls._collection.create_index(
-                    "created_at",
-                    expireAfterSeconds=expire_after_seconds,
-                    name=index_name,
-                )
-            else:
-                raise e
-
-        return cls._collection
+    @staticmethod
+    def _report_id(report_id: str) -> ObjectId | str:
+        # Deferred reports are saved under their string ids
+        return ObjectId(report_id) if ObjectId.is_valid(report_id) else report_id
 
     @classmethod
-    async def get_report(cls, report_id: str) -> Report | None:
+    async def find_report(cls, report_id: str) -> Report | None:
         col = await cls.col()
         if col is None:
             return None
 
-        data = await col.find_one({"_id": ObjectId(report_id)})
+        data = await col.find_one({"_id": cls._report_id(report_id)})
         if not data:
             return None
         d = dict(data)
@@ -61,7 +38,7 @@ class Reporter(MongoDatabase):
         return Report.from_dict(d)
 
     @classmethod
-    async def save_report(cls, report: Report) -> str | None:
+    async def save_report(cls, report: Report, report_id: str | None = None) -> str | None:
         col = await cls.col()
         if col is None:
             return None
@@ -69,32 +46,37 @@ class Reporter(MongoDatabase):
         now = datetime.utcnow()
         data = report.to_dict()
         data.pop("@type")
-        res = await col.insert_one(
-            {
-                "created_at": now,
-                "updated_at": now,
-                **data,
-            }
+        if report_id is None:
+            res = await col.insert_one(
+                {
+                    "created_at": now,
+                    "updated_at": now,
+                    **data,
+                }
+            )
+            return str(res.inserted_id)
+        await col.update_one(
+            {"_id": cls._report_id(report_id)},
+            {"$set": {"updated_at": now, **data}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
         )
-        return str(res.inserted_id)
+        return report_id
 
     @classmethod
     async def update_report(cls, report_id: str, report: Report) -> None:
-        if not cls._db:
-            return None
         col = await cls.col()
+        if col is None:
+            return None
+        data = report.to_dict()
+        data.pop("@type")
         await col.update_one(
-            {"_id": report_id},
-            {**report.to_dict(), "updated_at": datetime.utcnow()},
+            {"_id": cls._report_id(report_id)},
+            {"$set": {**data, "updated_at": datetime.utcnow()}},
         )
 
     @classmethod
     async def delete_report(cls, report_id: str) -> None:
         col = await cls.col()
-        if col is not None:
+        if col is None:
             return None
-        await col.delete_one({"_id": report_id})
-
-    @classmethod
-    async def from_context(cls, ctx: CallbackContext) -> list[Report]:
-        return await asyncio.gather(*(cls.get_report(arg[7:]) for arg in (ctx.args or []) if arg.startswith("report_")))
+        await col.delete_one({"_id": cls._report_id(report_id)})
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytz
+from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from pymongo import IndexModel, UpdateOne
+
+from app import constants
+from app.database.connector import MongoDatabase
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+
+class ShortLinkCache(MongoDatabase):
+    """Short links (like `vm.tiktok.com/ZS...`) resolved to the author and video id."""
+
+    COLLECTION = "short_links"
+    INDEXES = [
+        IndexModel("expires_at", expireAfterSeconds=0, name="expires_at_ttl"),
+    ]
+    _collection: Collection | None = None
+    # Empty tuple means that the link can't be resolved
+    memory: TTLCache[str, tuple[str, int] | tuple[()]] = TTLCache(max_items=100_000)
+
+    @classmethod
+    async def get_location(cls, url: str) -> tuple[str, int] | tuple[()] | None:
+        location = cls.memory.get(url)
+        if location is not None:
+            metrics.incr("short_links.memory_hit")
+            return location
+
+        col = await cls.col()
+        if col is None:
+            return None
+
+        now = datetime.now(tz=pytz.UTC)
+        data = await col.find_one({"_id": url, "expires_at": {"$gt": now}})
+        if not data:
+            metrics.incr("short_links.miss")
+            return None
+
+        metrics.incr("short_links.db_hit")
+        location = (data["author"], data["video_id"]) if data.get("video_id") else ()
+        ttl = (data["expires_at"].replace(tzinfo=pytz.UTC) - now).total_seconds()
+        cls.memory.set(url, location, ttl=ttl)
+        return location
+
+    @classmethod
+    def save_location(cls, url: str, location: tuple[str, int] | None) -> None:
+        """Remember the location in memory, and save it to the database in background."""
+        ttl = constants.SHORT_LINK_CACHE_TTL if location else constants.SHORT_LINK_NOT_FOUND_TTL
+        cls.memory.set(url, location or (), ttl=ttl)
+
+        author, video_id = location or (None, None)
+        now = datetime.now(tz=pytz.UTC)
+        data = {"author": author, "video_id": video_id, "created_at": now, "expires_at": now + timedelta(seconds=ttl)}
+        cls.write_in_background([UpdateOne({"_id": url}, {"$set": data}, upsert=True)])
+
+
+metrics.gauge("short_links.memory", ShortLinkCache.memory.stats)
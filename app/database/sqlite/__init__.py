@@ -0,0 +1,4 @@
+from app.database.sqlite.connector import SQLiteDatabase
+from app.database.sqlite.media_cache import SQLiteMediaCache
+from app.database.sqlite.persistence import SQLitePersistence
+from app.database.sqlite.reporter import SQLiteReporter
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import sqlite3
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import ClassVar, TypeVar
+
+from app import constants
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+class SQLiteDatabase:
+    """Local SQLite database (in WAL mode) for single-node deployments.
+
+    Queries are blocking (and can wait for a lock up to `busy_timeout`), so they run in one dedicated thread,
+    that owns the connection. Tables are created once in `init`.
+    """
+
+    TABLE: ClassVar[str | None] = None
+    SCHEMA: ClassVar[list[str]] = []
+
+    _connection: sqlite3.Connection | None = None
+    _executor: ThreadPoolExecutor | None = None
+    _init_lock = asyncio.Lock()
+
+    @classmethod
+    async def init(cls) -> None:
+        async with SQLiteDatabase._init_lock:
+            if SQLiteDatabase._connection is None:
+                await cls._open()
+
+    @classmethod
+    async def _open(cls) -> None:
+        SQLiteDatabase._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        SQLiteDatabase._connection = await asyncio.get_running_loop().run_in_executor(
+            SQLiteDatabase._executor, cls._connect
+        )
+        logger.info("Opened SQLite database %s", constants.SQLITE_PATH)
+        for sub_cls in cls.__subclasses__():
+            await sub_cls.write(sub_cls._setup)
+
+    @staticmethod
+    def _connect() -> sqlite3.Connection:
+        constants.SQLITE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(constants.SQLITE_PATH, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    @classmethod
+    def close(cls) -> None:
+        if SQLiteDatabase._executor is not None:
+            # Waits for the queries in progress
+            SQLiteDatabase._executor.shutdown(wait=True)
+            SQLiteDatabase._executor = None
+        if SQLiteDatabase._connection is not None:
+            SQLiteDatabase._connection.close()
+            SQLiteDatabase._connection = None
+
+    @classmethod
+    def db(cls) -> sqlite3.Connection | None:
+        return SQLiteDatabase._connection
+
+    @classmethod
+    async def run(cls, func: Callable[[sqlite3.Connection], _T]) -> _T:
+        """Run `func(connection)` in the database thread."""
+        connection = cls.db()
+        return await asyncio.get_running_loop().run_in_executor(SQLiteDatabase._executor, func, connection)
+
+    @classmethod
+    async def query(cls, sql: str, params: tuple = ()) -> list[tuple]:
+        return await cls.run(lambda db: db.execute(sql, params).fetchall())
+
+    @classmethod
+    async def write(cls, func: Callable[[sqlite3.Connection], _T]) -> _T:
+        """Run `func(connection)` in the database thread in one transaction."""
+
+        def transaction(connection: sqlite3.Connection) -> _T:
+            with connection:
+                return func(connection)
+
+        return await cls.run(transaction)
+
+    @classmethod
+    def _setup(cls, connection: sqlite3.Connection) -> None:
+        for statement in cls.SCHEMA:
+            connection.execute(statement)
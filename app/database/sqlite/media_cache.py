@@ -0,0 +1,118 @@
+import json
+import logging
+import time
+
+from app.database.sqlite.connector import SQLiteDatabase
+from app.models.medias import Media
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _expires_at(medias: tuple[Media, ...]) -> float | None:
+    expires_at = min((m.expires_at for m in medias if m.expires_at), default=None)
+    return expires_at.timestamp() if expires_at else None
+
+
+class SQLiteMediaCache(SQLiteDatabase):
+    TABLE = "media_cache"
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS media_cache (
+            url TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            expires_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS media_cache_expires_at ON media_cache (expires_at)",
+    ]
+
+    @classmethod
+    async def get_medias(cls, original_url: str) -> list[Media] | None:
+        if cls.db() is None:
+            return None
+        # Signed URLs of expired media don't work anymore
+        rows = await cls.query(
+            "SELECT content FROM media_cache WHERE url = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (original_url, time.time()),
+        )
+        if not rows:
+            metrics.incr("media_cache.miss")
+            return None
+        medias = [Media.from_dict(i) for i in json.loads(rows[0][0])]
+        if any(m.is_expired() for m in medias):
+            return None
+        metrics.incr("media_cache.hit")
+        return medias
+
+    @classmethod
+    async def get_many(cls, original_urls: list[str]) -> dict[str, list[Media]]:
+        """Medias by original URL. Not found media is missing in the result. The database is queried once."""
+        urls = list(dict.fromkeys(original_urls))
+        if not urls or cls.db() is None:
+            return {}
+        rows = await cls.query(
+            f"SELECT url, content FROM media_cache WHERE url IN ({', '.join('?' * len(urls))})"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (*urls, time.time()),
+        )
+        found: dict[str, list[Media]] = {}
+        for url, content in rows:
+            medias = [Media.from_dict(i) for i in json.loads(content)]
+            if medias and not any(m.is_expired() for m in medias):
+                found[url] = medias
+        metrics.incr("media_cache.hit", len(found))
+        metrics.incr("media_cache.miss", len(urls) - len(found))
+        return found
+
+    @classmethod
+    async def save_medias(cls, *medias: Media) -> str | None:
+        if not medias or cls.db() is None:
+            return None
+        url = medias[0].original_url
+        now = time.time()
+        params = (url, json.dumps([m.to_dict() for m in medias]), now, now, _expires_at(medias))
+        await cls.write(
+            lambda db: db.execute(
+                """
+                INSERT INTO media_cache (url, content, created_at, updated_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE
+                SET content = excluded.content, updated_at = excluded.updated_at, expires_at = excluded.expires_at
+                """,
+                params,
+            )
+        )
+        return url
+
+    @classmethod
+    async def update_medias(cls, original_url: str, *medias: Media) -> None:
+        if cls.db() is None:
+            return None
+        params = (json.dumps([m.to_dict() for m in medias]), time.time(), _expires_at(medias), original_url)
+        await cls.write(
+            lambda db: db.execute(
+                "UPDATE media_cache SET content = ?, updated_at = ?, expires_at = ? WHERE url = ?",
+                params,
+            )
+        )
+
+    @classmethod
+    async def delete_media(cls, original_url: str) -> None:
+        if cls.db() is None:
+            return None
+        await cls.write(lambda db: db.execute("DELETE FROM media_cache WHERE url = ?", (original_url,)))
+
+    @classmethod
+    async def flush(cls, wait: bool = False) -> None:
+        """Writes are not delayed, so only media with expired URLs is removed."""
+        if cls.db() is None:
+            return None
+        now = time.time()
+        deleted = await cls.write(
+            lambda db: db.execute("DELETE FROM media_cache WHERE expires_at <= ?", (now,)).rowcount
+        )
+        if deleted:
+            logger.info("Removed %d expired media(s) from cache", deleted)
@@ -0,0 +1,76 @@
+import json
+import logging
+import sqlite3
+from collections.abc import Hashable
+
+from app.database.persistence import Changes, LazyPersistence
+from app.database.sqlite.connector import SQLiteDatabase
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceTable(SQLiteDatabase):
+    # One row per key of the user, chat, bot or conversation data
+    TABLE = "persistence"
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (kind, id, key)
+        ) WITHOUT ROWID
+        """,
+    ]
+
+
+class SQLitePersistence(LazyPersistence):
+    """Persistence in the `persistence` table of the SQLite database. Values are saved as JSON."""
+
+    async def _init(self) -> None:
+        await SQLiteDatabase.init()
+
+    async def _load(self, kind: str, id_: Hashable) -> dict:
+        rows = await PersistenceTable.query(
+            "SELECT key, value FROM persistence WHERE kind = ? AND id = ?",
+            (kind, json.dumps(id_)),
+        )
+        return {key: json.loads(value) for key, value in rows}
+
+    async def _save(self, changes: Changes) -> Changes:
+        to_set = []
+        to_unset = []
+        for (kind, id_), update in changes.items():
+            for key, value in update.get("$set", {}).items():
+                try:
+                    encoded = json.dumps(value)
+                except (TypeError, ValueError) as e:
+                    # It would be loaded as another type, so it's not saved at all
+                    logger.error("Can't save %r of %s %s as JSON: %s", key, kind, id_, e)
+                    metrics.incr("persistence.unserializable")
+                    continue
+                to_set.append((kind, json.dumps(id_), key, encoded))
+            for key in update.get("$unset", {}):
+                to_unset.append((kind, json.dumps(id_), key))
+
+        def save(db: sqlite3.Connection) -> None:
+            db.executemany(
+                "INSERT INTO persistence (kind, id, key, value) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (kind, id, key) DO UPDATE SET value = excluded.value",
+                to_set,
+            )
+            db.executemany("DELETE FROM persistence WHERE kind = ? AND id = ? AND key = ?", to_unset)
+
+        try:
+            await PersistenceTable.write(save)
+        except sqlite3.Error as e:
+            logger.error("Failed to save %d change(s) to SQLite", len(changes), exc_info=e)
+            return changes
+        return {}
+
+    async def _delete(self, kind: str, id_: Hashable) -> None:
+        await PersistenceTable.write(
+            lambda db: db.execute("DELETE FROM persistence WHERE kind = ? AND id = ?", (kind, json.dumps(id_)))
+        )
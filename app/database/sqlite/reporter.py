@@ -0,0 +1,55 @@
+import json
+import secrets
+import sqlite3
+import time
+
+from app.database.backend import REPORT_TTL, ReporterBase
+from app.database.sqlite.connector import SQLiteDatabase
+from app.models.report import Report
+
+
+class SQLiteReporter(ReporterBase, SQLiteDatabase):
+    TABLE = "reports"
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS reports (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS reports_created_at ON reports (created_at)",
+    ]
+
+    @classmethod
+    async def find_report(cls, report_id: str) -> Report | None:
+        if cls.db() is None:
+            return None
+        rows = await cls.query(
+            "SELECT data FROM reports WHERE id = ? AND created_at > ?",
+            (report_id, time.time() - REPORT_TTL),
+        )
+        if not rows:
+            return None
+        return Report.from_dict(json.loads(rows[0][0]))
+
+    @classmethod
+    async def save_report(cls, report: Report, report_id: str | None = None) -> str | None:
+        if cls.db() is None:
+            return None
+        report_id = report_id or secrets.token_urlsafe(12)
+        now = time.time()
+        data = report.to_dict()
+        data.pop("@type")
+
+        def save(db: sqlite3.Connection) -> None:
+            db.execute("DELETE FROM reports WHERE created_at <= ?", (now - REPORT_TTL,))
+            db.execute(
+                "INSERT INTO reports (id, data, created_at, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (report_id, json.dumps(data), now, now),
+            )
+
+        await cls.write(save)
+        return report_id
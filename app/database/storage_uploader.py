@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+
+from telegram import Message
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+from app import constants
+from app.database.telegram_files import TelegramFileCache
+from app.models.medias import Video
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+from app.utils.upload_pool import UploadPool
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("StorageUploader",)
+
+
+class StorageUploader:
+    """Uploads popular videos to the storage chat in background.
+
+    Telegram can't always download videos from CDN URLs by itself,
+    so file ids of uploaded videos are saved to `TelegramFileCache` and reused by all chats.
+    Disabled when `STORAGE_CHAT_ID` is not set.
+    """
+
+    QUEUE_SIZE = 1000
+
+    _app: Application | None = None
+    _queue: asyncio.Queue[Video] | None = None
+    _workers: list[asyncio.Task] = []
+    # original_url -> times the video was found
+    _hits: TTLCache[str, int] = TTLCache(ttl=24 * 60 * 60, max_items=100_000)
+    _queued: set[str] = set()
+    _rate_lock = asyncio.Lock()
+    _next_upload = 0.0
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return constants.STORAGE_CHAT_ID is not None and cls._queue is not None
+
+    @classmethod
+    async def start(cls, app: Application) -> None:
+        if constants.STORAGE_CHAT_ID is None:
+            return None
+        cls._app = app
+        cls._queue = asyncio.Queue(maxsize=cls.QUEUE_SIZE)
+        cls._workers = [
+            asyncio.create_task(cls._worker(), name=f"storage-uploader-{i}")
+            for i in range(constants.STORAGE_UPLOAD_CONCURRENCY)
+        ]
+        logger.info("Started %d storage uploader(s)", len(cls._workers))
+
+    @classmethod
+    async def stop(cls) -> None:
+        for worker in cls._workers:
+            worker.cancel()
+        await asyncio.gather(*cls._workers, return_exceptions=True)
+        cls._workers = []
+        cls._queue = None
+        cls._queued.clear()
+
+    @classmethod
+    def hit(cls, video: Video) -> None:
+        """Count the video as found, and upload it when it's popular enough."""
+        if not cls.enabled() or not isinstance(video, Video):
+            return None
+        url = video.original_url
+        if url in cls._queued or (cls._app.bot.id, url) in TelegramFileCache.memory:
+            return None
+        hits = cls._hits.get(url, 0) + 1
+        cls._hits.set(url, hits)
+        if hits < constants.STORAGE_UPLOAD_THRESHOLD:
+            return None
+        try:
+            cls._queue.put_nowait(video.copy())
+        except asyncio.QueueFull:
+            metrics.incr("storage_upload.dropped")
+            return None
+        cls._queued.add(url)
+        metrics.incr("storage_upload.queued")
+
+    @classmethod
+    async def _wait_rate(cls) -> None:
+        interval = 60 / constants.STORAGE_UPLOAD_RATE if constants.STORAGE_UPLOAD_RATE > 0 else 0
+        async with cls._rate_lock:
+            delay = cls._next_upload - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            cls._next_upload = time.monotonic() + interval
+
+    @classmethod
+    async def _worker(cls) -> None:
+        while True:
+            video = await cls._queue.get()
+            try:
+                await cls._wait_rate()
+                with metrics.timer("storage_upload"):
+                    await cls._upload(video)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.incr("storage_upload.failed")
+                logger.warning("Failed to upload %s to the storage chat", video.original_url, exc_info=e)
+            finally:
+                cls._queued.discard(video.original_url)
+                cls._queue.task_done()
+
+    @classmethod
+    async def _upload(cls, video: Video) -> None:
+        bot = cls._app.bot
+        if await TelegramFileCache.get_video(bot.id, video.original_url):
+            return None
+        kwargs = {
+            "chat_id": constants.STORAGE_CHAT_ID,
+            "caption": video.original_url,
+            "supports_streaming": True,
+            "width": video.video_width,
+            "height": video.video_height,
+            "duration": video.video_duration,
+            "disable_notification": True,
+        }
+        try:
+            message = await bot.send_video(video=video.url, **kwargs)
+        except TelegramError as e:
+            # Telegram can't download the video, so the bot uploads it
+            logger.info("Telegram can't send %s by URL: %s. Uploading it", video.original_url, e)
+            message = await UploadPool.run(cls._upload_file, video, kwargs)
+            if message is None:
+                metrics.incr("storage_upload.too_large")
+                return None
+        await TelegramFileCache.save_video(bot.id, video.original_url, message.video.to_dict())
+        metrics.incr("storage_upload.uploaded")
+        logger.info("Uploaded %s to the storage chat", video.original_url)
+
+    @classmethod
+    async def _upload_file(cls, video: Video, kwargs: dict) -> Message | None:
+        async with video.download() as file:
+            if file is None:
+                return None
+            # Default write timeout of PTB is too short to upload a large video
+            return await cls._app.bot.send_video(
+                video=video.file_input(file),
+                write_timeout=constants.UPLOAD_TIMEOUT,
+                **kwargs,
+            )
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from pymongo import IndexModel, UpdateOne
+from pymongo.errors import PyMongoError
+
+from app import constants
+from app.database.connector import MongoDatabase
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Fields of `telegram.Video`, that are needed to send it again
+VIDEO_FIELDS = ("file_id", "file_unique_id", "width", "height", "duration", "file_size", "mime_type")
+
+
+class TelegramFileCache(MongoDatabase):
+    """Telegram videos (file ids) already uploaded by the bot, one per original URL and bot."""
+
+    COLLECTION = "telegram_files"
+    INDEXES = [
+        # Videos that are not sent for a long time are removed by MongoDB
+        IndexModel("accessed_at", expireAfterSeconds=constants.TG_FILE_CACHE_TTL, name="accessed_at_ttl"),
+    ]
+    _collection: Collection | None = None
+    # (bot id, original_url) -> video
+    memory: TTLCache[tuple[int, str], dict] = TTLCache(max_items=constants.TG_FILE_CACHE_MAX_ITEMS)
+    # Videos not found in the database, so they are not requested again for a while
+    misses: TTLCache[tuple[int, str], bool] = TTLCache(ttl=10 * 60, max_items=constants.TG_FILE_CACHE_MAX_ITEMS)
+    # (bot id, original_url) -> when `accessed_at` was saved to the database
+    _touched: TTLCache[tuple[int, str], datetime] = TTLCache(max_items=constants.TG_FILE_CACHE_MAX_ITEMS)
+    # Ids of documents, which `accessed_at` is saved in background
+    _pending_touches: set[str] = set()
+    _touch_timer: asyncio.TimerHandle | None = None
+    _touch_tasks: set[asyncio.Task] = set()
+
+    # `accessed_at` is saved not more often than once per this interval
+    TOUCH_INTERVAL = timedelta(days=1)
+    # Seconds `accessed_at` of sent videos is collected before it's saved in one write
+    TOUCH_WRITE_DELAY = 60
+
+    @staticmethod
+    def _key(bot_id: int, original_url: str) -> str:
+        return f"{bot_id}:{original_url}"
+
+    @classmethod
+    async def get_video(cls, bot_id: int, original_url: str) -> dict | None:
+        return (await cls.get_videos(bot_id, [original_url])).get(original_url)
+
+    @classmethod
+    async def get_videos(cls, bot_id: int, original_urls: list[str]) -> dict[str, dict]:
+        """Videos by original URL. Not found videos are missing in the result. The database is queried once."""
+        videos: dict[str, dict] = {}
+        to_find: list[str] = []
+        for url in dict.fromkeys(original_urls):
+            video = cls.memory.get((bot_id, url))
+            if video is not None:
+                metrics.incr("telegram_files.memory_hit")
+                videos[url] = video
+            elif (bot_id, url) in cls.misses:
+                metrics.incr("telegram_files.miss")
+            else:
+                to_find.append(url)
+
+        col = await cls.col()
+        if to_find and col is not None:
+            found = {
+                data["_id"]: data
+                async for data in col.find({"_id": {"$in": [cls._key(bot_id, url) for url in to_find]}})
+            }
+            for url in to_find:
+                data = found.get(cls._key(bot_id, url))
+                if not data:
+                    metrics.incr("telegram_files.miss")
+                    cls.misses.set((bot_id, url), True)
+                    continue
+                metrics.incr("telegram_files.db_hit")
+                videos[url] = {k: data.get(k) for k in VIDEO_FIELDS}
+                cls.memory.set((bot_id, url), videos[url])
+
+        for url in videos:
+            cls._touch(bot_id, url)
+        return videos
+
+    @classmethod
+    def _touch(cls, bot_id: int, original_url: str) -> None:
+        now = datetime.now(tz=pytz.UTC)
+        touched = cls._touched.get((bot_id, original_url))
+        if cls._db is None or (touched is not None and now - touched < cls.TOUCH_INTERVAL):
+            return None
+        cls._touched.set((bot_id, original_url), now)
+        cls._pending_touches.add(cls._key(bot_id, original_url))
+        if cls._touch_timer is None:
+            cls._touch_timer = asyncio.get_running_loop().call_later(cls.TOUCH_WRITE_DELAY, cls._start_flush)
+
+    @classmethod
+    def _start_flush(cls) -> None:
+        task = asyncio.create_task(cls.flush())
+        cls._touch_tasks.add(task)
+        task.add_done_callback(cls._touch_tasks.discard)
+
+    @classmethod
+    async def flush(cls, wait: bool = False) -> None:
+        """Save `accessed_at` of sent videos. With `wait`, also wait for the writes already in progress."""
+        if cls._touch_timer is not None:
+            cls._touch_timer.cancel()
+            cls._touch_timer = None
+        if wait and cls._touch_tasks:
+            await asyncio.gather(*cls._touch_tasks, return_exceptions=True)
+        col = await cls.col()
+        if not cls._pending_touches or col is None:
+            return None
+        ids = list(cls._pending_touches)
+        cls._pending_touches.clear()
+        try:
+            await col.update_many({"_id": {"$in": ids}}, {"$set": {"accessed_at": datetime.now(tz=pytz.UTC)}})
+        except PyMongoError as e:
+            logger.warning("Failed to save access time of %d Telegram video(s)", len(ids), exc_info=e)
+
+    @classmethod
+    def _operation(cls, bot_id: int, original_url: str, video: dict, now: datetime, overwrite: bool) -> UpdateOne:
+        data = {k: video.get(k) for k in VIDEO_FIELDS}
+        on_insert = {"original_url": original_url, "bot_id": bot_id, "created_at": now}
+        if overwrite:
+            update = {"$set": {**data, "accessed_at": now}, "$setOnInsert": on_insert}
+        else:
+            update = {"$setOnInsert": {**data, **on_insert, "accessed_at": now}}
+        return UpdateOne({"_id": cls._key(bot_id, original_url)}, update, upsert=True)
+
+    @classmethod
+    async def save_video(cls, bot_id: int, original_url: str, video: dict) -> None:
+        now = datetime.now(tz=pytz.UTC)
+        cls.memory.set((bot_id, original_url), {k: video.get(k) for k in VIDEO_FIELDS})
+        cls.misses.pop((bot_id, original_url))
+        cls._touched.set((bot_id, original_url), now)
+
+        col = await cls.col()
+        if col is None:
+            return None
+        await col.bulk_write([cls._operation(bot_id, original_url, video, now, overwrite=True)])
+
+    @classmethod
+    async def delete_video(cls, bot_id: int, original_url: str) -> None:
+        """Forget the video, e.g. when Telegram doesn't accept its file id anymore."""
+        cls.memory.pop((bot_id, original_url))
+        cls._touched.pop((bot_id, original_url))
+        cls._pending_touches.discard(cls._key(bot_id, original_url))
+
+        col = await cls.col()
+        if col is None:
+            return None
+        await col.delete_one({"_id": cls._key(bot_id, original_url)})
+
+    @classmethod
+    async def migrate(cls, bot_id: int, bot_data: dict) -> None:
+        """Move videos from the old `tg_video_cache` of `bot_data` to the collection."""
+        videos: dict[str, dict] | None = bot_data.pop("tg_video_cache", None)
+        if not videos:
+            return None
+        col = await cls.col()
+        if col is None:
+            bot_data["tg_video_cache"] = videos
+            return None
+        now = datetime.now(tz=pytz.UTC)
+        operations = [
+            cls._operation(bot_id, url, video, now, overwrite=False)
+            for url, video in videos.items()
+            if video and video.get("file_id")
+        ]
+        if operations:
+            await col.bulk_write(operations, ordered=False)
+        logger.info("Moved %d Telegram video(s) from bot data", len(operations))
+
+
+metrics.gauge("telegram_files.memory", TelegramFileCache.memory.stats)
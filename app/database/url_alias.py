@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytz
+from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from pymongo import IndexModel, UpdateOne
+
+from app.database.connector import MongoDatabase
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
+
+
+class UrlAlias(MongoDatabase):
+    """Other forms of the media URL (short links, mirrors, platform ids) mapped to the canonical URL."""
+
+    COLLECTION = "url_aliases"
+    INDEXES = [
+        IndexModel("target", name="target"),
+    ]
+    _collection: Collection | None = None
+    memory: TTLCache[str, str] = TTLCache(max_items=100_000)
+
+    @classmethod
+    async def get_target(cls, alias: str) -> str | None:
+        target = cls.memory.get(alias)
+        if target is not None:
+            return target
+
+        col = await cls.col()
+        if col is None:
+            return None
+
+        data = await col.find_one({"_id": alias})
+        if not data:
+            return None
+        cls.memory.set(alias, data["target"])
+        return data["target"]
+
+    @classmethod
+    def save_aliases(cls, target: str, *aliases: str) -> None:
+        """Remember the aliases in memory, and save them to the database in background."""
+        # Skip aliases that are already known
+        aliases = tuple(a for a in dict.fromkeys(aliases) if a and a != target and cls.memory.get(a) != target)
+        if not aliases:
+            return None
+
+        for alias in aliases:
+            cls.memory.set(alias, target)
+
+        now = datetime.now(tz=pytz.UTC)
+        cls.write_in_background(
+            [
+                UpdateOne(
+                    {"_id": alias},
+                    {
+                        "$set": {"target": target, "updated_at": now},
+                        "$setOnInsert": {"created_at": now},
+                    },
+                    upsert=True,
+                )
+                for alias in aliases
+            ]
+        )
+
+
+metrics.gauge("url_aliases.memory", UrlAlias.memory.stats)
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from pydantic.json import pydantic_encoder
 
 
 class Model(BaseModel):
@@ -16,7 +17,8 @@ class Model(BaseModel):
         def encoder(v) -> dict:
             if isinstance(v, Model):
                 return v.to_dict()
-            return v
+            # Datetime (like `Media.expires_at`) and other types, that json can't encode
+            return pydantic_encoder(v)
 
         d = self.__config__.json_loads(  # type: ignore[attr-defined]
             self.json(
@@ -32,6 +34,8 @@ class Model(BaseModel):
     @classmethod
     def from_dict(cls, value: dict) -> "Model":
         models: dict[str, type[Model]] = getattr(Model, "MODELS", {})
+        # `value` is not changed, it may be shared with a cache
+        value = dict(value)
         type_: str | None = value.pop("@type", None)
         return models.get(type_, cls)(**value)
 
@@ -1,23 +1,30 @@
 import enum
 import functools
 import re
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from string import ascii_uppercase
-from typing import Any, TypeVar
+from typing import IO, Any, TypeVar
+from urllib.parse import parse_qs, urlsplit
 
+import pytz
 import telegram
-from aiohttp import ClientSession
 from pydantic import Field
 from telegram import InputFile, InputMediaVideo
 
 from app.constants import Keys
 from app.context import CallbackContext
 from app.settings.user_settings import DescriptionTypes
+from app.utils.download import download_file
 from app.utils.i18n import _
 
 from .base import Model
 
 MAKE_CAPTION_DEFAULT = TypeVar("MAKE_CAPTION_DEFAULT", bound=Any)
 FLAG_OFFSET = ord("🇦") - ord("A")
+# Query params of signed CDN URLs with expiration time (unix timestamp, `oe` is in hex)
+EXPIRE_PARAMS = ("x-expires", "expire", "expires", "Expires", "oe")
 
 
 class ParserType(enum.StrEnum):
@@ -39,6 +46,21 @@ def lang_emoji(lang: str) -> str:
     return ""
 
 
+def url_expires_at(url: str | None) -> datetime | None:
+    """Get expiration time of the signed CDN URL."""
+    if not url:
+        return None
+    query = parse_qs(urlsplit(url).query)
+    for param in EXPIRE_PARAMS:
+        value = query.get(param, [""])[0]
+        try:
+            timestamp = int(value, 16 if param == "oe" else 10)
+        except ValueError:
+            continue
+        return datetime.fromtimestamp(timestamp, tz=pytz.UTC)
+    return None
+
+
 class Media(Model):
     caption: str
     type: ParserType
@@ -48,6 +70,7 @@ class Media(Model):
     author: str | None = None
     extra_description: str = ""
     language: str | None = None
+    expires_at: datetime | None = None
 
     @property
     def language_emoji(self) -> str:
@@ -63,6 +86,38 @@ class Media(Model):
     def __hash__(self) -> int:
         return hash(self.original_url)
 
+    @property
+    def urls(self) -> list[str]:
+        """URLs of the content, that can expire."""
+        return [url for url in (getattr(self, "url", None), *getattr(self, "images", [])) if url]
+
+    def set_expiration(self, default_ttl: int | None = None) -> None:
+        """Set expiration time from the URLs, or after `default_ttl` seconds."""
+        if self.expires_at is not None:
+            return None
+        expires = [e for e in map(url_expires_at, self.urls) if e]
+        if expires:
+            self.expires_at = min(expires)
+        elif default_ttl:
+            self.expires_at = datetime.now(tz=pytz.UTC) + timedelta(seconds=default_ttl)
+
+    def is_expired(self, before: float = 0) -> bool:
+        """Check that media is expired or will expire in `before` seconds."""
+        if self.expires_at is None:
+            return False
+        return self.expires_at <= datetime.now(tz=pytz.UTC) + timedelta(seconds=before)
+
+    @staticmethod
+    def caption_key(ctx: CallbackContext) -> tuple:
+        """Settings, that change `real_caption` and other texts of the media for the user."""
+        return (
+            ctx.user_lang,
+            ctx.settings[Keys.ADD_DESCRIPTION],
+            ctx.settings[Keys.ADD_AUTHOR_MENTION],
+            ctx.settings[Keys.ADD_ORIGINAL_LINK],
+            ctx.settings[Keys.TIKTOK_FLAG],
+        )
+
     def real_caption(
         self, ctx: CallbackContext, default: MAKE_CAPTION_DEFAULT | None = None
     ) -> str | MAKE_CAPTION_DEFAULT:
@@ -98,41 +153,42 @@ class Video(Media):
     max_quality_url: str | None = None
     audio_url: str | None = None
     mime_type: str = "video/mp4"
-    video_content: bytes | None = None
     video_height: int | None = None
     video_width: int | None = None
     video_duration: int | None = None
+    # Size in bytes, if the source knows it, or bits per second to estimate it
+    file_size: int | None = None
+    bitrate: int | None = None
 
     def __bool__(self) -> bool:
         return bool(self.url)
 
-    async def content(
-        self,
-        user_agent: str | None = None,
-    ) -> bytes:
-        if self.video_content:
-            return self.video_content
-
+    @property
+    def expected_size(self) -> int | None:
+        """Size of the video in bytes before downloading it."""
+        if self.file_size:
+            return self.file_size
+        if self.bitrate and self.video_duration:
+            return self.bitrate * self.video_duration // 8
+        return None
+
+    @asynccontextmanager
+    async def download(self, user_agent: str | None = None) -> AsyncIterator[IO[bytes] | None]:
+        """Download the video to a temporary file, `None` if it's larger than Telegram file limit."""
         headers = {}
         if user_agent is not None:
             headers["User-Agent"] = user_agent
 
-        async with ClientSession(headers=headers) as session:
-            async with session.get(self.url) as resp:
-                self.video_content = await resp.content.read()
-        return self.video_content
+        async with download_file(self.url, headers=headers, expected_size=self.expected_size) as file:
+            yield file
 
-    @property
-    def file_input(self) -> InputFile | None:
-        if not self.video_content:
-            return None
-        return InputFile(self.video_content, filename=self.original_url)
+    def file_input(self, file: IO[bytes], attach: bool = False) -> InputFile:
+        # The file is read by the HTTP client while uploading, instead of loading it into memory
+        return InputFile(file, filename=self.original_url, attach=attach, read_file_handle=False)
 
-    def file_media(self, ctx: CallbackContext) -> InputMediaVideo | None:
-        if not self.video_content:
-            return None
+    def file_media(self, ctx: CallbackContext, file: IO[bytes]) -> InputMediaVideo:
         return InputMediaVideo(
-            self.file_input,
+            self.file_input(file, attach=True),
             caption=self.real_caption(ctx),
             width=self.video_width,
             height=self.video_height,
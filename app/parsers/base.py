@@ -1,17 +1,38 @@
+import asyncio
 import logging
 import time
 from abc import ABC, abstractmethod
 from re import Match, Pattern
 from typing import ClassVar
+from urllib.parse import urlsplit
 
 import aiohttp
 
+from app import constants
 from app.database import MediaCache as MediaCacheDB
+from app.database import NegativeCache, UrlAlias
 from app.models.medias import Media, ParserType
+from app.utils import HttpClient
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_url(url: str) -> str:
+    """Make a key for the URL, ignoring scheme, `www.` and trailing slash."""
+    url = url.strip()
+    if "://" not in url:
+        url = f"//{url}"
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").removeprefix("www.")
+    except ValueError:
+        return url
+    key = f"{host}{parts.path.rstrip('/')}"
+    if parts.query:
+        key += f"?{parts.query}"
+    return key
+
+
 class MediaCache:
     class FoundCache(Exception):
         def __init__(self, medias: list[Media], original_url: str, *args) -> None:
@@ -19,34 +40,171 @@ class MediaCache:
             self.medias = medias
             self.original_url = original_url
 
-    @classmethod
-    async def find_by_original_url(cls, original_url: str | None = None) -> None:
-        data = await MediaCacheDB.get_medias(original_url)
+    # Parses in progress, concurrent lookups of the same URL wait for the first one
+    _in_flight: ClassVar[dict[str, asyncio.Future[list[Media]]]] = {}
+
+    def __init__(
+        self,
+        service: ParserType | None = None,
+        default_ttl: int | None = None,
+        refresh: bool = False,
+    ) -> None:
+        # Keys of `_in_flight`, that this lookup parses
+        self._owned: list[str] = []
+        self.service = service
+        # Seconds before the media expires, when URL doesn't contain expiration time
+        self.default_ttl = default_ttl
+        # Parse the media again, even if it's found in the cache
+        self.refresh = refresh
+        self.original_url: str | None = None
+        # Other keys of the media, saved as aliases of the canonical URL
+        self.aliases: list[str] = []
+        self.reason: str | None = None
+        self.transient: bool = False
+
+    async def find_by_original_url(self, original_url: str | None = None, native_id: str | int | None = None) -> None:
+        """Find media by canonical URL, or by platform id of the media (video id, tweet id, etc.)."""
+        self.original_url = original_url
+        if self.refresh:
+            return None
+        if native_id is not None:
+            native_key = f"{self.service}:{native_id}"
+            self.aliases.append(native_key)
+            target = await UrlAlias.get_target(native_key)
+            if target and target != original_url:
+                data = await self.get_medias(target)
+                if data:
+                    self.original_url = target
+                    raise self.FoundCache(
+                        medias=data,
+                        original_url=target,
+                    )
+
+        await self._wait_in_flight(original_url)
+
+        reason = await NegativeCache.get_reason(original_url)
+        if reason is not None:
+            logger.info("Found no media for %s before: %s", original_url, reason)
+            raise self.FoundCache(
+                medias=[],
+                original_url=original_url,
+            )
+
+        data = await self.get_medias(original_url)
         if data:
-            raise cls.FoundCache(
+            raise self.FoundCache(
                 medias=data,
                 original_url=original_url,
             )
 
+        # Another parse could start while the database was queried
+        await self._wait_in_flight(original_url)
+        if original_url:
+            self.claim(original_url)
+
+    def claim(self, key: str) -> None:
+        """Make other lookups of `key` wait for this one, until `release`."""
+        if key not in self._owned and key not in self._in_flight:
+            self._owned.append(key)
+            self._in_flight[key] = asyncio.get_running_loop().create_future()
+
+    async def wait_in_flight(self, key: str) -> None:
+        """Wait for another lookup of `key`, and raise `FoundCache` with its result."""
+        await self._wait_in_flight(key)
+
+    @staticmethod
+    async def get_medias(original_url: str) -> list[Media] | None:
+        """Get medias from the cache, and refresh them in background before they expire."""
+        medias = await MediaCacheDB.get_medias(original_url)
+        if medias and any(m.is_expired(before=constants.MEDIA_CACHE_REFRESH_BEFORE) for m in medias):
+            Parser.refresh_in_background(original_url)
+        return medias
+
+    async def _wait_in_flight(self, original_url: str | None) -> None:
+        future = self._in_flight.get(original_url)
+        if future is None or original_url in self._owned:
+            return None
+        logger.info("Waiting for parse in progress for %s", original_url)
+        try:
+            medias = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if future.cancelled() and current is not None and not current.cancelling():
+                # The first parse was cancelled (like superseded inline query), so media is parsed here
+                return None
+            raise
+        raise self.FoundCache(
+            medias=[m.copy() for m in medias],
+            original_url=original_url,
+        )
+
+    def release(
+        self,
+        medias: list[Media] | None = None,
+        exc: Exception | None = None,
+        cancelled: bool = False,
+    ) -> None:
+        """Share the result with the waiting lookups and stop owning the URL."""
+        owned, self._owned = self._owned, []
+        for key in owned:
+            future = self._in_flight.pop(key, None)
+            if future is None or future.done():
+                continue
+            if cancelled:
+                future.cancel()
+            elif exc is not None:
+                future.set_exception(exc)
+                # Mark exception as retrieved, when nobody is waiting for the result
+                future.exception()
+            else:
+                future.set_result(medias or [])
+
+    def no_media(self, reason: str, transient: bool = False) -> list[Media]:
+        """Remember why the link has no media. Transient reasons are cached for a shorter time."""
+        logger.info("No media for %s: %s", self.original_url, reason)
+        self.reason = reason
+        self.transient = transient
+        return []
+
+    def save_aliases(self, *keys: str) -> None:
+        if self.original_url:
+            UrlAlias.save_aliases(self.original_url, *keys, *self.aliases)
+
+    def save_not_found(self, *keys: str) -> None:
+        ttl = constants.NOT_FOUND_CACHE_ERROR_TTL if self.transient else constants.NOT_FOUND_CACHE_TTL
+        NegativeCache.save_reason(self.reason or "No media found", ttl, self.original_url, *keys)
+
     @staticmethod
     async def save(media: Media) -> Media:
         res = await MediaCacheDB.save_medias(media)
         logger.info("Saved item to cache for %s", res)
         return media
 
-    @classmethod
-    async def save_group(cls, medias: list[Media]) -> list[Media]:
+    async def save_group(self, medias: list[Media]) -> list[Media]:
+        for media in medias:
+            media.set_expiration(self.default_ttl)
         res = await MediaCacheDB.save_medias(*medias)
         logger.info("Saved %d item(s) to cache for %s", len(medias), res)
+        self.release(medias)
         return medias
 
 
 class Parser(ABC):
     TYPE: ClassVar[ParserType | None] = None
     REG_EXPS: ClassVar[list[Pattern]] = []
+    # Domains of the links, subdomains are matched too (`tiktok.com` matches `vm.tiktok.com`)
+    HOSTS: ClassVar[tuple[str, ...]] = ()
+    # Seconds before media URLs expire, when URLs don't contain expiration time
+    MEDIA_TTL: ClassVar[int | None] = None
     _parsers: ClassVar[list[type["Parser"]]] = []
+    _hosts: ClassVar[dict[str, list[type["Parser"]]]] = {}
     CUSTOM_EMOJI_ID: ClassVar[int] = 0
 
+    # Every parser talks to a single upstream API, so limits are applied per service
+    _semaphore: ClassVar[asyncio.Semaphore | None] = None
+    _service_semaphores: ClassVar[dict[ParserType | None, asyncio.Semaphore]] = {}
+    _refreshing: ClassVar[dict[str, asyncio.Task]] = {}
+
     @classmethod
     @abstractmethod
     def _is_supported(cls) -> bool:
@@ -56,6 +214,56 @@ class Parser(ABC):
     def parsers(cls) -> list[type["Parser"]]:
         return Parser._parsers
 
+    @classmethod
+    def _close(cls) -> None:
+        """Release resources of the parser (e.g. thread pools) on shutdown."""
+        return None
+
+    @classmethod
+    def close(cls) -> None:
+        for parser in Parser._parsers:
+            parser._close()
+
+    @staticmethod
+    def _host(string: str) -> str | None:
+        string = string.strip()
+        if "://" not in string:
+            string = f"//{string}"
+        try:
+            host = urlsplit(string).hostname
+        except ValueError:
+            return None
+        return host.removeprefix("www.") if host else None
+
+    @classmethod
+    def _candidates(cls, string: str) -> list[type["Parser"]]:
+        host = cls._host(string)
+        if not host:
+            return []
+        parts = host.split(".")
+        for i in range(len(parts) - 1):
+            parsers = Parser._hosts.get(".".join(parts[i:]))
+            if parsers:
+                return parsers
+        return []
+
+    @classmethod
+    def _matches(cls, string: str) -> list[tuple[type["Parser"], Match]]:
+        result = []
+        for parser in cls._candidates(string):
+            for reg_exp in parser.REG_EXPS:
+                match = reg_exp.match(string)
+                if match:
+                    result.append((parser, match))
+                    break
+        return result
+
+    @classmethod
+    def match(cls, url: str) -> tuple[type["Parser"], Match] | None:
+        """Find the parser that owns the URL without parsing it."""
+        matches = cls._matches(url)
+        return matches[0] if matches else None
+
     @classmethod
     @abstractmethod
     async def _parse(
@@ -66,28 +274,119 @@ class Parser(ABC):
     ) -> list[Media]:
         raise NotImplementedError
 
+    @classmethod
+    def _limits(cls) -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        if Parser._semaphore is None:
+            Parser._semaphore = asyncio.Semaphore(constants.PARSE_CONCURRENCY)
+        service = Parser._service_semaphores.get(cls.TYPE)
+        if service is None:
+            service = Parser._service_semaphores[cls.TYPE] = asyncio.Semaphore(constants.PARSE_HOST_CONCURRENCY)
+        return Parser._semaphore, service
+
+    @classmethod
+    async def _run(
+        cls,
+        session: aiohttp.ClientSession,
+        match: Match,
+    ) -> list[Media]:
+        link = match.group(0)
+        reason = await NegativeCache.get_reason(link)
+        if reason is not None:
+            logger.info("Found no media for %s before: %s", link, reason)
+            return []
+
+        # Known short links and mirrors are resolved without requests to the service
+        link_key = normalize_url(link)
+        target = await UrlAlias.get_target(link_key)
+        if target:
+            medias = await MediaCache.get_medias(target)
+            if medias:
+                logger.info("Found cache for %s by alias %s", target, link_key)
+                return medias
+
+        cache = MediaCache(cls.TYPE, cls.MEDIA_TTL)
+        # The same link being parsed is waited for before taking parse slots, so waiters don't hold them
+        try:
+            await cache.wait_in_flight(link_key)
+        except MediaCache.FoundCache as e:
+            logger.info("Found parse in progress for %s", link_key)
+            return e.medias
+        cache.claim(link_key)
+
+        global_limit, service_limit = cls._limits()
+        # Global slot is taken only after the service one, so links to a busy service don't hold it while waiting
+        try:
+            async with service_limit, global_limit:
+                medias = await cls._parse(session, match, cache=cache)
+        except MediaCache.FoundCache as e:
+            logger.info("Found cache for %s", e.original_url)
+            cache.release(e.medias)
+            if e.medias:
+                cache.save_aliases(link_key)
+            return e.medias
+        except Exception as e:
+            cache.release(exc=e)
+            cache.no_media(f"{type(e).__name__}: {e}", transient=True)
+            cache.save_not_found(link)
+            raise
+        except asyncio.CancelledError:
+            cache.release(cancelled=True)
+            raise
+        cache.release(medias)
+        if medias:
+            cache.save_aliases(link_key)
+        else:
+            cache.save_not_found(link)
+        return medias
+
+    @classmethod
+    def refresh_in_background(cls, original_url: str) -> None:
+        """Parse the media again without waiting, so cache has fresh URLs before old ones expire."""
+        if original_url in Parser._refreshing:
+            return None
+        found = cls.match(original_url)
+        if found is None:
+            return None
+        parser, match = found
+        task = asyncio.create_task(parser._refresh(match))
+        Parser._refreshing[original_url] = task
+        task.add_done_callback(lambda _: Parser._refreshing.pop(original_url, None))
+
+    @classmethod
+    async def _refresh(cls, match: Match) -> None:
+        logger.info("Refreshing cache for %s", match.string)
+        global_limit, service_limit = cls._limits()
+        async with service_limit, global_limit:
+            try:
+                await cls._parse(HttpClient.session(), match, cache=MediaCache(cls.TYPE, cls.MEDIA_TTL, refresh=True))
+            except Exception as e:
+                logger.warning("Failed to refresh cache for %s: %s", match.string, e)
+
     @classmethod
     async def parse(
         cls,
         session: aiohttp.ClientSession,
         *strings: str,
     ) -> list[Media]:
-        result: list[Media] = []
         start_time = time.time()
+        matches = []
         for string in strings:
-            for parser in cls._parsers:
-                for reg_exp in parser.REG_EXPS:
-                    match = reg_exp.match(string)
-                    if not match:
-                        continue
-                    logger.info("Found match for %s: %r", parser.TYPE, match.string)
-                    try:
-                        medias = await parser._parse(session, match, cache=MediaCache())
-                    except MediaCache.FoundCache as e:
-                        medias = e.medias
-                        logger.info("Found cache for %s", e.original_url)
-                    result.extend(medias)
-                    break
+            for parser, match in cls._matches(string):
+                logger.info("Found match for %s: %r", parser.TYPE, match.string)
+                matches.append((parser, match))
+
+        # Links are resolved concurrently, but result keeps order of the links.
+        # Failed link doesn't drop media of others
+        results = await asyncio.gather(
+            *(parser._run(session, match) for parser, match in matches),
+            return_exceptions=True,
+        )
+        result: list[Media] = []
+        for (parser, match), medias in zip(matches, results):
+            if isinstance(medias, BaseException):
+                logger.error("Failed to parse %r with %s", match.string, parser.TYPE, exc_info=medias)
+                continue
+            result.extend(medias)
         logger.info(
             "Parsed %d items in %.4f seconds",
             len(result),
@@ -100,3 +399,5 @@ class Parser(ABC):
         if cls._is_supported():
             logger.info("Registering Parser[%s]", cls.TYPE)
             Parser._parsers.append(cls)
+            for host in cls.HOSTS:
+                Parser._hosts.setdefault(host, []).append(cls)
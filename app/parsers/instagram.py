@@ -75,6 +75,8 @@ class Parser(BaseParser):
         # https://instagram.com/reel/CqQGB-1ISIw/
         INSTAGRAM_RE,
     ]
+    HOSTS = ("instagram.com",)
+    MEDIA_TTL = 12 * 60 * 60
     CUSTOM_EMOJI_ID = 5465453979896913711  # 💬
 
     @classmethod
@@ -126,9 +128,10 @@ class Parser(BaseParser):
         logger.info("Got data: %s", data)
         shortcode_media = data.get("data", {}).get("shortcode_media") or {}
 
+        if data.get("status") == "fail":
+            return cache.no_media(f"Request failed: {data.get('message')}", transient=True)
         if not shortcode_media.get("is_video", False):
-            logger.info("%s is not a video", original_url)
-            return []
+            return cache.no_media("Not a video")
         caption = shortcode_media.get("title", None)
         if not caption:
             caption = " ".join(
@@ -139,7 +142,7 @@ class Parser(BaseParser):
             ).strip()
         url: str | None = shortcode_media.get("video_url", None)
         if not url:
-            return []
+            return cache.no_media("No video url found")
 
         thumbnail_url = shortcode_media.get("display_url", None)
 
@@ -176,7 +179,7 @@ class Parser(BaseParser):
         ) as resp:
             if resp.status != 200:
                 logger.error("Error: %s %s", resp.status, await resp.text())
-                return []
+                return cache.no_media(f"Lamadava request failed with status {resp.status}", transient=True)
             data: dict = await resp.json()
 
         logger.info("Got data: %s", data)
@@ -185,8 +188,7 @@ class Parser(BaseParser):
 
         url: str | None = data.get("video_url", None)
         if not url:
-            logger.info("%s is not a video", original_url)
-            return []
+            return cache.no_media("Not a video")
 
         caption = data.get("title", None) or data.get("caption_text", None)
 
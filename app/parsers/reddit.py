@@ -75,6 +75,7 @@ class Parser(BaseParser):
         # www.reddit.com/gallery/2gmzqe
         re.compile(r"(?:https?://)?(?:www\.)?reddit\.com/(?P<link>[\w/]+)"),
     ]
+    HOSTS = ("reddit.com", "redd.it")
     CUSTOM_EMOJI_ID = 5465648490375814741  # 💬
 
     @classmethod
@@ -104,13 +105,11 @@ class Parser(BaseParser):
         cmt = await comment(session, comment_id)
         media = cmt.get("media", {})
         if not media:
-            logger.info("No media found")
-            return []
+            return cache.no_media("No media found")
 
         video_url = media.get("reddit_video", {}).get("fallback_url", "").rstrip("?source=fallback")
         if not video_url:
-            logger.info("No video found")
-            return []
+            return cache.no_media("No video found")
 
         author = cmt.get("author")
         title = cmt.get("title")
@@ -9,8 +9,9 @@ import aiohttp
 from aiohttp import ClientSession
 
 from app import constants
+from app.database import ShortLinkCache
 from app.models.medias import Media, MediaGroup, ParserType, Video
-from app.utils import timeit
+from app.utils import HttpClient, metrics, timeit
 
 from .base import MediaCache
 from .base import Parser as BaseParser
@@ -43,8 +44,13 @@ class Parser(BaseParser):
         # https://www.tiktok.com/@thejoyegg/video/7136001098841591041
         re.compile(r"(?:https?://)?" r"(?:www\.)?tiktok\.com/@(?P<author>\w+)/video/(?P<video_id>\d+)/?"),
     ]
+    HOSTS = ("tiktok.com",)
+    MEDIA_TTL = 6 * 60 * 60
     CUSTOM_EMOJI_ID = 5465416081105493315  # 📹
 
+    class NoRedirect(Exception):
+        """TikTok didn't redirect the short link (like when it limits requests), so it may work later."""
+
     @classmethod
     def _is_supported(cls) -> bool:
         return True
@@ -67,10 +73,12 @@ class Parser(BaseParser):
             url_id = m["id"]
             original_url = f"https://www.tiktok.com/{suffix}/{url_id}"
             logger.info("Get video id from: %s", original_url)
-            video_location = await cls._get_video_id(original_url)
-            print(video_location)
+            try:
+                video_location = await cls._get_video_id(session, original_url)
+            except cls.NoRedirect as e:
+                return cache.no_media(str(e), transient=True)
             if video_location is None:
-                return []
+                return cache.no_media("Video id not found")
             author, video_id = video_location
 
         elif "id" in m:
@@ -78,9 +86,12 @@ class Parser(BaseParser):
             domain = m.get("domain", "vt")
             original_url = f"https://{domain}.tiktok.com/{url_id}"
             logger.info("Get video id from: %s", original_url)
-            video_location = await cls._get_video_id(original_url)
+            try:
+                video_location = await cls._get_video_id(session, original_url)
+            except cls.NoRedirect as e:
+                return cache.no_media(str(e), transient=True)
             if video_location is None:
-                return []
+                return cache.no_media("Video id not found")
             author, video_id = video_location
 
         else:
@@ -89,7 +100,7 @@ class Parser(BaseParser):
             original_url = f"https://www.tiktok.com/@{author}/video/{video_id}"
 
         with timeit("cache.find_by_original_url", logger):
-            await cache.find_by_original_url(original_url)
+            await cache.find_by_original_url(original_url, native_id=video_id)
 
         logger.info(
             "Getting video link from: %s (video_id=%d)",
@@ -98,7 +109,7 @@ class Parser(BaseParser):
         )
 
         try:
-            data: dict = await cls._get_video_data(video_id)
+            data: dict = await cls._get_video_data(session, video_id)
 
         except Exception as e:
             logger.exception(
@@ -106,7 +117,7 @@ class Parser(BaseParser):
                 original_url,
                 exc_info=e,
             )
-            return []
+            return cache.no_media(f"Error while getting video data: {e}", transient=True)
         # real_author = data.get("author", {}).get("unique_id", "").lower()
         # if author and author != real_author:
         #     logger.info(
@@ -116,27 +127,32 @@ class Parser(BaseParser):
         #     )
         #     return []
 
+        if not data:
+            # TikTok answers with an empty feed when it limits requests
+            return cache.no_media("Empty response from TikTok", transient=True)
+
         media_type: Literal["video", "image", None] = data.get("type", None)
         logger.info("Media type: %s", media_type)
         if media_type == "video":
             return await cache.save_group(cls._process_video(data, original_url))
         elif media_type == "image":
             return await cache.save_group(cls._process_image(data, original_url))
-        return []
+        return cache.no_media(f"Unsupported media type: {media_type}")
 
     @staticmethod
     def _process_video(data: dict, original_url: str) -> list[Video]:
         max_quality_url = data.get("video_data", {}).get("nwm_video_url_HQ")
         try:
-            url: str | None = max(
+            play_addr: dict = max(
                 filter(
                     lambda x: x.get("data_size", 0) <= constants.TG_FILE_LIMIT,
                     (x.get("play_addr", {}) for x in data.get("video", {}).get("bit_rate", [])),
                 ),
                 key=lambda x: x.get("data_size", 0),
-            ).get("url_list", [None])[0]
+            )
         except ValueError:
-            url = None
+            play_addr = {}
+        url: str | None = play_addr.get("url_list", [None])[0]
 
         if not url:
             logger.info("No url in response")
@@ -156,6 +172,7 @@ class Parser(BaseParser):
             original_url=original_url,
             language=language,
             max_quality_url=max_quality_url,
+            file_size=play_addr.get("data_size") or None,
         )
         if video:
             return [video]
@@ -166,13 +183,28 @@ class Parser(BaseParser):
         return []
 
     @classmethod
-    async def _get_video_id(cls, url: str) -> tuple[str, int] | None:
+    async def _get_video_id(cls, session: ClientSession, url: str) -> tuple[str, int] | None:
+        """Author and video id of the short link. Raises `NoRedirect` (and it's not cached) if it's not redirected."""
+        location = await ShortLinkCache.get_location(url)
+        if location is not None:
+            logger.info("Found cached location for %s: %s", url, location)
+            return location or None
+
+        with metrics.timer("tiktok.short_link_resolve"):
+            location = await cls._resolve_video_id(session, url)
+        ShortLinkCache.save_location(url, location)
+        return location
+
+    @classmethod
+    async def _resolve_video_id(cls, session: ClientSession, url: str) -> tuple[str, int] | None:
         counter = 0
-        async with ClientSession() as session:
-            while "@" not in url and counter < 5:
-                async with session.get(url, allow_redirects=False) as resp:
-                    url = resp.headers.get("Location", "").split("?", 1)[0]
-                    counter += 1
+        while "@" not in url and counter < 5:
+            async with session.get(url, allow_redirects=False) as resp:
+                location = resp.headers.get("Location", "").split("?", 1)[0]
+            if not location:
+                raise cls.NoRedirect(f"No redirect from {url} (status {resp.status})")
+            url = location
+            counter += 1
 
         base = url.rsplit("/", 1)[-1]
         author = url.split("@", 1)[-1].split("/", 1)[0]
@@ -181,32 +213,26 @@ class Parser(BaseParser):
         return author, int(base)
 
     @staticmethod
-    async def _get_video_data(video_id: int) -> dict:
-        async with ClientSession(
-            headers={
-                # "Accept": "application/json",
-                # "User-Agent": TT_USER_AGENT,
-            }
-        ) as session:
-            async with session.get(
-                "https://api22-normal-c-alisg.tiktokv.com/aweme/v1/feed/",
-                params={
-                    "iid": "7318518857994389254",
-                    "device_id": "7318517321748022790",
-                    "channel": "googleplay",
-                    "app_name": "musical_ly",
-                    "version_code": "300904",
-                    "device_platform": "android",
-                    "device_type": "ASUS_Z01QD",
-                    "os_version": "9",
-                    "aweme_id": video_id,
-                },
-            ) as resp:
-                raw_data: dict = await resp.json()
-            if not raw_data:
-                logger.error("Empty response with %r", resp.url)
-                return {}
-        print(raw_data)
+    async def _get_video_data(session: ClientSession, video_id: int) -> dict:
+        async with session.get(
+            "https://api22-normal-c-alisg.tiktokv.com/aweme/v1/feed/",
+            params={
+                "iid": "7318518857994389254",
+                "device_id": "7318517321748022790",
+                "channel": "googleplay",
+                "app_name": "musical_ly",
+                "version_code": "300904",
+                "device_platform": "android",
+                "device_type": "ASUS_Z01QD",
+                "os_version": "9",
+                "aweme_id": video_id,
+            },
+        ) as resp:
+            raw_data: dict = await resp.json()
+        if not raw_data:
+            logger.error("Empty response with %r", resp.url)
+            return {}
+        logger.debug("Got data: %s", raw_data)
         if not raw_data.get("aweme_list", []):
             logger.info("No aweme_list in response")
             return {}
@@ -259,13 +285,15 @@ class Parser(BaseParser):
 
 
 async def main() -> None:
-    async with ClientSession() as session:
+    try:
         print(
             await Parser.parse(
-                session,
+                HttpClient.session(),
                 "https://vm.tiktok.com/ZMYQFQBQ9/",
             )
         )
+    finally:
+        await HttpClient.close()
 
 
 if __name__ == "__main__":
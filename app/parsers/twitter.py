@@ -24,6 +24,7 @@ class Parser(BaseParser):
         # https://t.co/sOHvySZwUo
         re.compile(r"(?:https?://)?t\.co/(?P<tco_id>\w+)"),
     ]
+    HOSTS = ("twitter.com", "t.co")
     CUSTOM_EMOJI_ID = 5465453979896913711  # 💬
 
     @classmethod
@@ -50,7 +51,7 @@ class Parser(BaseParser):
 
         original_url = f"https://twitter.com/i/status/{tweet_id}"
 
-        await cache.find_by_original_url(original_url)
+        await cache.find_by_original_url(original_url, native_id=tweet_id)
 
         logger.info("Getting video link from: %s", original_url)
 
@@ -61,6 +62,7 @@ class Parser(BaseParser):
                     (
                         "type",
                         "variants",
+                        "duration_ms",
                     )
                 ),
                 "expansions": ",".join(
@@ -85,12 +87,16 @@ class Parser(BaseParser):
         for media in medias:
             if media.get("type") == "video":
                 thumbnail_url = media.get("preview_image_url")
+                variant = max(
+                    media.get("variants", []),
+                    key=lambda x: x.get("bit_rate", 0),
+                )
+                duration_ms = media.get("duration_ms")
                 result.append(
                     Video(
-                        url=max(
-                            media.get("variants", []),
-                            key=lambda x: x.get("bit_rate", 0),
-                        ).get("url"),
+                        url=variant.get("url"),
+                        bitrate=variant.get("bit_rate"),
+                        video_duration=duration_ms // 1000 if duration_ms else None,
                         caption=caption,
                         thumbnail_url=thumbnail_url,
                         type=ParserType.TWITTER,
@@ -1,20 +1,49 @@
+import asyncio
 import logging
 import re
+import socket
 from re import Match
+from typing import Any, NamedTuple
 
 import aiohttp
 import pytube as pytube
-from pytube import StreamQuery
+from pytube import Stream, StreamQuery
 from pytube.exceptions import PytubeError
 
 from app import constants
 from app.models.medias import Media, ParserType, Video
 from app.parsers.base import MediaCache
 from app.parsers.base import Parser as BaseParser
+from app.utils.blocking_pool import BlockingPool
+from app.utils.cache import TTLCache
+from app.utils.metrics import metrics
 from app.utils.time_it import timeit
 
 logger = logging.getLogger(__name__)
 
+_execute_request = pytube.request._execute_request
+
+
+def _execute_request_with_timeout(
+    *args: Any, timeout: float | object = socket._GLOBAL_DEFAULT_TIMEOUT, **kwargs: Any
+) -> Any:
+    # pytube doesn't pass a timeout to its requests, so a stalled connection would hold a thread of the pool forever
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = constants.YOUTUBE_TIMEOUT
+    return _execute_request(*args, timeout=timeout, **kwargs)
+
+
+pytube.request._execute_request = _execute_request_with_timeout
+
+
+class VideoInfo(NamedTuple):
+    author: str | None
+    title: str | None
+    thumbnail_url: str | None
+    length: int | None
+    # Progressive mp4 streams, the best first
+    streams: list[Stream]
+
 
 class Parser(BaseParser):
     TYPE = ParserType.YOUTUBE
@@ -26,12 +55,25 @@ class Parser(BaseParser):
         # https://youtube.com/watch?v=hBOLCcvbGHM
         re.compile(r"(?:https?://)?(?:www\.)?youtube\.com/shorts/(?P<id>[\w-]+)"),
     ]
+    HOSTS = ("youtube.com", "youtu.be")
+    MEDIA_TTL = 5 * 60 * 60
+    # Estimates of stream sizes closer than this part to the file limit are checked by HEAD requests
+    ESTIMATE_MARGIN = 0.25
     CUSTOM_EMOJI_ID = 5463206079913533096  # 📹
 
+    # (video id, itag) -> size of the stream in bytes
+    _sizes: TTLCache[tuple[str, int], int] = TTLCache(ttl=MEDIA_TTL, max_items=10_000)
+    _probe_semaphore = asyncio.Semaphore(constants.YOUTUBE_PROBE_CONCURRENCY)
+    _pool = BlockingPool("pytube", max_workers=constants.YOUTUBE_THREADS, timeout=constants.YOUTUBE_TIMEOUT)
+
     @classmethod
     def _is_supported(cls) -> bool:
         return True
 
+    @classmethod
+    def _close(cls) -> None:
+        cls._pool.shutdown()
+
     @classmethod
     async def _parse(
         cls,
@@ -45,51 +87,122 @@ class Parser(BaseParser):
             return []
 
         original_url = f"https://youtube.com/watch?v={yt_id}"
-        await cache.find_by_original_url(original_url)
+        await cache.find_by_original_url(original_url, native_id=yt_id)
 
         logger.info("Getting video link from: %s", original_url)
-        yt = pytube.YouTube(original_url)
-        with timeit("Getting streams", logger):
-            try:
-                streams_obj = StreamQuery(yt.fmt_streams)
-            except KeyError:
-                logger.info('No "fmt_streams" found for %r', original_url)
-                return []
-
-        streams = streams_obj.filter(type="video", progressive=True, file_extension="mp4").order_by("resolution")
-        logger.info("Found %s streams", len(streams))
-        stream = streams.last()
-        if not stream:
-            logger.info("No suitable streams found")
-            return []
+        try:
+            with timeit("Getting streams", logger):
+                info = await cls._pool.run(cls._get_info, original_url)
+        except KeyError:
+            return cache.no_media('No "fmt_streams" found')
+        except PytubeError as err:
+            logger.error("Failed to get video %r with error: %s", original_url, err)
+            return cache.no_media(f"Failed to get video: {err}")
+        except TimeoutError:
+            return cache.no_media("Timeout while getting video", transient=True)
 
-        max_quality_url = stream.url
-        max_fs = 0
+        logger.info("Found %s streams", len(info.streams))
+        if not info.streams:
+            return cache.no_media("No suitable streams found")
 
-        for st in streams:
-            logger.info("Stream: %s", st)
-            async with session.head(st.url) as resp:
-                file_size = int(resp.headers.get(aiohttp.hdrs.CONTENT_LENGTH, "0"))
-            logger.info("Stream file size: %s", file_size)
-            if constants.TG_FILE_LIMIT >= file_size > max_fs:
-                logger.info("Found suitable stream with filesize %s", file_size)
-                max_fs = file_size
-                stream = st
+        max_quality_url = info.streams[0].url
+        stream, file_size = await cls._select_stream(session, yt_id, info.streams, info.length)
+        stream = stream or info.streams[0]
 
         logger.info("Selected stream: %s", stream)
 
-        try:
-            video = Video(
-                author=yt.author,
-                caption=yt.title,
-                thumbnail_url=yt.thumbnail_url,
-                type=ParserType.YOUTUBE,
-                url=stream.url,
-                original_url=original_url,
-                max_quality_url=max_quality_url,
-                mime_type=stream.mime_type,
-            )
-        except PytubeError as err:
-            logger.error("Failed to get video %r with error: %s", original_url, err)
-            return []
+        video = Video(
+            author=info.author,
+            caption=info.title,
+            thumbnail_url=info.thumbnail_url,
+            type=ParserType.YOUTUBE,
+            url=stream.url,
+            original_url=original_url,
+            max_quality_url=max_quality_url,
+            mime_type=stream.mime_type,
+            file_size=file_size,
+        )
         return await cache.save_group([video])
+
+    @staticmethod
+    def _get_info(original_url: str) -> VideoInfo:
+        """Load the video page with pytube. It's blocking, so it runs in the thread pool."""
+        yt = pytube.YouTube(original_url)
+        streams = (
+            StreamQuery(yt.fmt_streams)
+            .filter(type="video", progressive=True, file_extension="mp4")
+            .order_by("resolution")
+            .desc()
+        )
+        try:
+            length = yt.length
+        except (PytubeError, TypeError, ValueError):
+            length = None
+        return VideoInfo(
+            author=yt.author,
+            title=yt.title,
+            thumbnail_url=yt.thumbnail_url,
+            length=length,
+            streams=list(streams),
+        )
+
+    @classmethod
+    async def _stream_size(
+        cls,
+        session: aiohttp.ClientSession,
+        yt_id: str,
+        stream: Stream,
+        duration: int | None,
+    ) -> int | None:
+        """Size of the stream from the cache, the manifest, a reliable estimate, or a HEAD request."""
+        key = (yt_id, stream.itag)
+        size = cls._sizes.get(key)
+        if size is not None:
+            return size
+
+        size = stream._filesize or None
+        if size is None and stream.bitrate and duration:
+            # Bitrate is only an average, so the estimate decides only when it's far from the limit
+            estimate = stream.bitrate * duration // 8
+            if abs(estimate - constants.TG_FILE_LIMIT) > cls.ESTIMATE_MARGIN * constants.TG_FILE_LIMIT:
+                logger.info("Estimated size of stream %s: %s", stream.itag, estimate)
+                return estimate
+
+        if size is None:
+            async with cls._probe_semaphore:
+                try:
+                    async with session.head(stream.url) as resp:
+                        size = int(resp.headers.get(aiohttp.hdrs.CONTENT_LENGTH, "0")) or None
+                except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+                    logger.warning("Failed to get size of stream %s: %s", stream.itag, e)
+                    return None
+            metrics.incr("youtube.probe")
+
+        if size is not None:
+            cls._sizes.set(key, size)
+        return size
+
+    @classmethod
+    async def _select_stream(
+        cls,
+        session: aiohttp.ClientSession,
+        yt_id: str,
+        streams: list[Stream],
+        duration: int | None,
+    ) -> tuple[Stream | None, int | None]:
+        """The best of `streams` (ordered from the best), that fits into the Telegram file limit.
+
+        Sizes are probed concurrently, and the rest of probes are cancelled as soon as all better streams are known.
+        """
+        tasks = [asyncio.create_task(cls._stream_size(session, yt_id, st, duration)) for st in streams]
+        try:
+            for st, task in zip(streams, tasks):
+                file_size = await task
+                logger.info("Stream %s file size: %s", st, file_size)
+                if file_size is not None and file_size <= constants.TG_FILE_LIMIT:
+                    logger.info("Found suitable stream with filesize %s", file_size)
+                    return st, file_size
+        finally:
+            for task in tasks:
+                task.cancel()
+        return None, None
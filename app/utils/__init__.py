@@ -1,4 +1,13 @@
 from app.utils.app_patchers import *
+from app.utils.blocking_pool import *
+from app.utils.byte_budget import *
+from app.utils.cache import *
+from app.utils.coordinator import *
+from app.utils.download import *
+from app.utils.http_client import *
 from app.utils.i18n import *
+from app.utils.inline_cache import *
+from app.utils.metrics import *
 from app.utils.text_format import *
 from app.utils.time_it import *
+from app.utils.upload_pool import *
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("BlockingPool",)
+
+_T = TypeVar("_T")
+
+
+class BlockingPool:
+    """Runs blocking code (sync network clients) in a dedicated thread pool, so it doesn't stop the event loop.
+
+    Not more than `max_workers` functions run at the same time, others wait in the queue.
+    The caller stops waiting after `timeout` seconds with `TimeoutError`: a queued function is cancelled,
+    a running one can't be stopped, and its result is dropped.
+    """
+
+    def __init__(self, name: str, max_workers: int, timeout: float) -> None:
+        self.name = name
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        metrics.gauge(f"{name}.pool", self.stats)
+
+    def _call(self, func: Callable[..., _T], args: tuple, queued_at: float) -> _T:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        metrics.observe(f"{self.name}.wait", time.perf_counter() - queued_at)
+        try:
+            with metrics.timer(f"{self.name}.run"):
+                return func(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _on_done(self, future: Future) -> None:
+        if future.cancelled():
+            # It was removed from the queue before it started
+            with self._lock:
+                self._queued -= 1
+
+    async def run(self, func: Callable[..., _T], *args: Any) -> _T:
+        """Run `func(*args)` in the pool. Raises `TimeoutError` after the timeout."""
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(self._call, func, args, time.perf_counter())
+        future.add_done_callback(self._on_done)
+        try:
+            async with asyncio.timeout(self.timeout):
+                # Cancelling the asyncio future cancels the queued function too
+                return await asyncio.wrap_future(future)
+        except TimeoutError:
+            metrics.incr(f"{self.name}.timeout")
+            logger.warning("%s didn't finish in %s seconds", getattr(func, "__name__", func), self.timeout)
+            raise
+
+    def shutdown(self) -> None:
+        """Cancel queued functions and don't accept new ones. Running ones are not waited for."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, int]:
+        return {"queued": self._queued, "running": self._running}
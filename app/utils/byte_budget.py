@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from app import constants
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("ByteBudget", "Reservation")
+
+
+class ByteBudget:
+    """Bytes of files (in memory and on disk), that the bot holds while downloading and uploading them.
+
+    Every download reserves its expected size before it starts, and resizes the reservation when the real size
+    is known, so all files in flight never take more than `FILE_BUDGET` bytes. Others wait in FIFO order
+    (a large file is not starved by small ones) not longer than `FILE_BUDGET_TIMEOUT` seconds.
+    Growing downloads wait before new ones, so they are never blocked by a download waiting for their bytes.
+    """
+
+    _used = 0
+    _waiters: deque[tuple[int, asyncio.Future]] = deque()
+    # Reservations, that are already held and grow, go before new ones: new ones may wait for their bytes
+    _growing: deque[tuple[int, asyncio.Future]] = deque()
+
+    @classmethod
+    def _wake(cls) -> None:
+        for queue in (cls._growing, cls._waiters):
+            while queue and cls._used + queue[0][0] <= constants.FILE_BUDGET:
+                size, waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                cls._used += size
+                waiter.set_result(None)
+            if queue:
+                return None
+
+    @classmethod
+    async def _acquire(cls, size: int, timeout: float, held: bool = False) -> None:
+        start = time.perf_counter()
+        ahead = cls._growing if held else cls._growing or cls._waiters
+        if not ahead and cls._used + size <= constants.FILE_BUDGET:
+            cls._used += size
+            metrics.observe("byte_budget.wait", 0)
+            return None
+
+        queue = cls._growing if held else cls._waiters
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (size, waiter)
+        queue.append(entry)
+        try:
+            async with asyncio.timeout(timeout):
+                await waiter
+        except TimeoutError:
+            cls._forget(size, waiter, entry)
+            metrics.incr("byte_budget.timeout")
+            logger.warning("No free budget for %d bytes in %s seconds", size, timeout)
+            raise
+        except BaseException:
+            cls._forget(size, waiter, entry)
+            raise
+        metrics.observe("byte_budget.wait", time.perf_counter() - start)
+
+    @classmethod
+    def _forget(cls, size: int, waiter: asyncio.Future, entry: tuple[int, asyncio.Future]) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # Bytes were given right before the timeout
+            cls._release(size)
+            return None
+        waiter.cancel()
+        for queue in (cls._growing, cls._waiters):
+            if entry in queue:
+                queue.remove(entry)
+        cls._wake()
+
+    @classmethod
+    def _release(cls, size: int) -> None:
+        cls._used -= size
+        cls._wake()
+
+    @staticmethod
+    def _clamp(size: int) -> int:
+        # File larger than the budget still can be downloaded, but alone
+        return max(0, min(size, constants.FILE_BUDGET))
+
+    @classmethod
+    @asynccontextmanager
+    async def reserve(cls, size: int, timeout: float | None = None) -> AsyncIterator["Reservation"]:
+        """Hold `size` bytes of the budget. Raises `TimeoutError` if they aren't free in `timeout` seconds."""
+        reservation = Reservation(constants.FILE_BUDGET_TIMEOUT if timeout is None else timeout)
+        await reservation.resize(size)
+        try:
+            yield reservation
+        finally:
+            cls._release(reservation.size)
+            reservation.size = 0
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        return {
+            "limit": constants.FILE_BUDGET,
+            "used": cls._used,
+            "waiting": len(cls._waiters) + len(cls._growing),
+        }
+
+
+class Reservation:
+    """Bytes held in `ByteBudget` by one file. Size can be changed while the file is downloaded."""
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.size = 0
+
+    async def resize(self, size: int) -> None:
+        """Hold `size` bytes instead. Raises `TimeoutError` if more bytes aren't free in time."""
+        size = ByteBudget._clamp(size)
+        if size > self.size:
+            await ByteBudget._acquire(size - self.size, self.timeout, held=self.size > 0)
+        elif size < self.size:
+            ByteBudget._release(self.size - size)
+        self.size = size
+
+
+metrics.gauge("byte_budget", ByteBudget.stats)
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Generic, TypeVar
+
+__all__ = ("TTLCache",)
+
+_K = TypeVar("_K")
+_V = TypeVar("_V")
+_D = TypeVar("_D")
+
+
+class TTLCache(Generic[_K, _V]):
+    """In-memory LRU cache with expiration and size limits.
+
+    Items are evicted when they are older than `ttl` seconds,
+    or when the cache has more than `max_items` items or `max_bytes` bytes.
+    Size of the item is calculated with `sizeof` (1 byte per item by default).
+    """
+
+    def __init__(
+        self,
+        ttl: float | None = None,
+        max_items: int | None = None,
+        max_bytes: int | None = None,
+        sizeof: Callable[[_V], int] | None = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda _: 1)
+        # key -> (expire time, size, value)
+        self._data: OrderedDict[_K, tuple[float | None, int, _V]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: _K, default: _D = None) -> _V | _D:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expire_at, _, value = item
+        if expire_at is not None and expire_at <= time.monotonic():
+            self.pop(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: _K, value: _V, ttl: float | None = None) -> None:
+        self.pop(key)
+        ttl = ttl if ttl is not None else self.ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return None
+
+        self._data[key] = (expire_at, size, value)
+        self.size += size
+        while (self.max_items is not None and len(self._data) > self.max_items) or (
+            self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            _, (_, old_size, _) = self._data.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+
+    def pop(self, key: _K, default: _D = None) -> _V | _D:
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self.size -= item[1]
+        return item[2]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.size = 0
+
+    def __contains__(self, key: _K) -> bool:
+        item = self._data.get(key)
+        return item is not None and (item[0] is None or item[0] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": len(self._data),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from collections.abc import Callable, Coroutine, Hashable
+from typing import Any, TypeVar
+
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("LatestTaskCoordinator",)
+
+_T = TypeVar("_T")
+
+
+class LatestTaskCoordinator:
+    """Runs only the latest task for every key.
+
+    A new call with the same key cancels the previous task, and the previous call returns `None`.
+    With `delay`, the task waits for a quiet period before it starts.
+    """
+
+    def __init__(self, name: str, delay: float = 0) -> None:
+        self.name = name
+        self.delay = delay
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    async def _delayed(self, func: Callable[..., Coroutine[Any, Any, _T]], *args: Any) -> _T:
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        return await func(*args)
+
+    async def run(self, key: Hashable, func: Callable[..., Coroutine[Any, Any, _T]], *args: Any) -> _T | None:
+        old = self._tasks.get(key)
+        if old is not None and not old.done():
+            old.cancel()
+
+        task = asyncio.create_task(self._delayed(func, *args))
+        self._tasks[key] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if task.cancelled() and current is not None and not current.cancelling():
+                logger.info("%s task for %s is superseded", self.name, key)
+                metrics.incr(f"{self.name}.superseded")
+                return None
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def __len__(self) -> int:
+        return len(self._tasks)
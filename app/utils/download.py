@@ -0,0 +1,61 @@
+import logging
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import IO
+
+from app import constants
+from app.utils.byte_budget import ByteBudget
+from app.utils.http_client import HttpClient
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("download_file",)
+
+CHUNK_SIZE = 64 * 1024
+
+
+@asynccontextmanager
+async def download_file(
+    url: str,
+    headers: dict[str, str] | None = None,
+    limit: int = constants.TG_FILE_LIMIT,
+    expected_size: int | None = None,
+) -> AsyncIterator[IO[bytes] | None]:
+    """Download the file to a temporary file, that is kept in memory only while it's small.
+
+    Yields `None` if the file is larger than `limit` bytes, and the download is stopped as soon as it's known.
+    Size of the file is reserved in `ByteBudget` before the request (`expected_size` or `limit`),
+    then it's changed to `Content-Length` or to the read bytes, until the file is removed on exit.
+    """
+    async with AsyncExitStack() as stack:
+        reservation = await stack.enter_async_context(ByteBudget.reserve(min(expected_size or limit, limit)))
+        file = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=constants.DOWNLOAD_SPOOL_SIZE))
+        size = 0
+        async with HttpClient.session().get(url, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.content_length is not None and resp.content_length > limit:
+                logger.info("File is too large (%d bytes): %s", resp.content_length, url)
+                metrics.incr("download.too_large")
+                yield None
+                return
+            if resp.content_length is not None:
+                await reservation.resize(resp.content_length)
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    logger.info("File is larger than %d bytes: %s", limit, url)
+                    metrics.incr("download.too_large")
+                    yield None
+                    return
+                if min(size, constants.FILE_BUDGET) > reservation.size:
+                    # File is larger than expected, so more bytes are held before writing it
+                    metrics.incr("download.underestimated")
+                    await reservation.resize(min(max(size, 2 * reservation.size), limit))
+                file.write(chunk)
+        # Bytes reserved for the unknown size are not needed anymore
+        await reservation.resize(size)
+        metrics.incr("download.bytes", size)
+        file.seek(0)
+        yield file
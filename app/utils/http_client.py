@@ -0,0 +1,45 @@
+import logging
+
+from aiohttp import ClientSession, DummyCookieJar, TCPConnector
+
+from app import constants
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("HttpClient",)
+
+
+class HttpClient:
+    """Shared HTTP session for all parsers and downloads.
+
+    Connections are pooled per host and kept alive between updates,
+    so requests to the same service don't pay TCP and TLS handshakes again.
+    Cookies are not kept, so they don't leak between users and parsers.
+    """
+
+    _session: ClientSession | None = None
+
+    @classmethod
+    def session(cls) -> ClientSession:
+        if cls._session is None or cls._session.closed:
+            connector = TCPConnector(
+                limit=constants.HTTP_LIMIT,
+                limit_per_host=constants.HTTP_LIMIT_PER_HOST,
+                use_dns_cache=True,
+                ttl_dns_cache=constants.HTTP_DNS_TTL,
+                keepalive_timeout=constants.HTTP_KEEPALIVE_TIMEOUT,
+            )
+            cls._session = ClientSession(connector=connector, cookie_jar=DummyCookieJar())
+            logger.info("Created HTTP session")
+        return cls._session
+
+    @classmethod
+    async def init(cls) -> None:
+        cls.session()
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+            logger.info("Closed HTTP session")
+        cls._session = None
@@ -0,0 +1,89 @@
+import enum
+import hashlib
+from collections.abc import Hashable
+from typing import NamedTuple
+
+from telegram import InlineQueryResult
+
+from app import constants
+from app.utils.cache import TTLCache
+
+__all__ = (
+    "InlineAnswerCache",
+    "InlineKind",
+    "InlinePolicy",
+    "inline_result_id",
+)
+
+
+class InlineKind(enum.StrEnum):
+    """Kind of the inline query answer."""
+
+    LINK = "link"
+    HISTORY = "history"
+    NOT_FOUND = "not_found"
+
+
+class InlinePolicy(NamedTuple):
+    # Seconds Telegram caches the answer
+    cache_time: int
+    # Telegram caches the answer only for the user who sent the query
+    is_personal: bool
+    # Seconds the bot keeps built results in memory (0 to disable)
+    local_ttl: int = 0
+
+
+def inline_result_id(original_url: str, index: int = 0) -> str:
+    """Result id, that is the same for every user and every answer with this media."""
+    return f"{hashlib.sha1(original_url.encode()).hexdigest()}_{index}"
+
+
+class InlineAnswerCache:
+    # Every answer has captions and button texts in the user's settings and language, and the user's report id,
+    # so Telegram must not share it with other users
+    POLICIES: dict[InlineKind, InlinePolicy] = {
+        InlineKind.LINK: InlinePolicy(
+            cache_time=constants.INLINE_LINK_CACHE_TIME,
+            is_personal=True,
+            local_ttl=constants.INLINE_LINK_CACHE_TIME,
+        ),
+        InlineKind.HISTORY: InlinePolicy(cache_time=1, is_personal=True),
+        InlineKind.NOT_FOUND: InlinePolicy(
+            cache_time=constants.INLINE_NOT_FOUND_CACHE_TIME,
+            is_personal=True,
+        ),
+    }
+
+    # (canonical URL, caption settings) -> built results
+    _results: TTLCache[Hashable, list[InlineQueryResult]] = TTLCache(max_items=10_000)
+    # Result id -> media dict, so results cached by Telegram can be resolved for any user
+    _medias: TTLCache[str, dict] = TTLCache(max_items=100_000)
+
+    @classmethod
+    def policy(cls, kind: InlineKind) -> InlinePolicy:
+        return cls.POLICIES[kind]
+
+    @classmethod
+    def get_results(cls, kind: InlineKind, key: Hashable) -> list[InlineQueryResult] | None:
+        if not cls.policy(kind).local_ttl:
+            return None
+        return cls._results.get((kind, key))
+
+    @classmethod
+    def set_results(
+        cls,
+        kind: InlineKind,
+        key: Hashable,
+        results: list[InlineQueryResult],
+        medias: dict[str, dict],
+    ) -> None:
+        policy = cls.policy(kind)
+        # Chosen result can come while Telegram still shows the cached answer
+        for result_id, media in medias.items():
+            cls._medias.set(result_id, media, ttl=max(policy.cache_time, policy.local_ttl) + 60 * 60)
+        if policy.local_ttl:
+            cls._results.set((kind, key), results, ttl=policy.local_ttl)
+
+    @classmethod
+    def get_media(cls, result_id: str) -> dict | None:
+        return cls._medias.get(result_id)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("metrics",)
+
+
+class Metrics:
+    """In-process counters, timings and gauges for monitoring."""
+
+    def __init__(self) -> None:
+        self._counters: defaultdict[str, int] = defaultdict(int)
+        # name -> [count, total seconds, max seconds]
+        self._timings: dict[str, list[float]] = {}
+        self._gauges: dict[str, Callable[[], Any]] = {}
+        self._log_task: asyncio.Task | None = None
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def gauge(self, name: str, func: Callable[[], Any]) -> None:
+        """Register function that returns the current value of the gauge."""
+        self._gauges[name] = func
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "counters": dict(self._counters),
+            "timings": {
+                name: {"count": count, "avg": total / count if count else 0.0, "max": max_}
+                for name, (count, total, max_) in self._timings.items()
+            },
+            "gauges": {name: func() for name, func in self._gauges.items()},
+        }
+
+    def log(self, log: logging.Logger = logger) -> None:
+        log.info("Metrics: %s", self.snapshot())
+
+    async def _log_periodically(self, interval: float, log: logging.Logger) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.log(log)
+            except Exception as e:
+                log.warning("Failed to log metrics", exc_info=e)
+
+    def start_logging(self, interval: float, log: logging.Logger = logger) -> None:
+        """Log metrics every `interval` seconds while the bot runs. Disabled if `interval` is not positive."""
+        if interval <= 0 or self._log_task is not None:
+            return None
+        self._log_task = asyncio.create_task(self._log_periodically(interval, log), name="metrics-log")
+
+    async def stop_logging(self) -> None:
+        if self._log_task is None:
+            return None
+        self._log_task.cancel()
+        await asyncio.gather(self._log_task, return_exceptions=True)
+        self._log_task = None
+
+
+metrics = Metrics()
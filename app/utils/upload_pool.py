@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Coroutine
+from typing import Any, TypeVar
+
+from app import constants
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("UploadPool",)
+
+_T = TypeVar("_T")
+
+
+class UploadPool:
+    """Limits videos, that the bot downloads and uploads by itself.
+
+    Not more than `UPLOAD_CONCURRENCY` uploads run at the same time, others wait in the queue.
+    Every upload is stopped after `UPLOAD_TIMEOUT` seconds. Size of the files is limited by `ByteBudget`.
+    """
+
+    _semaphore: asyncio.Semaphore | None = None
+    _running = 0
+
+    @classmethod
+    def _init(cls) -> None:
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(constants.UPLOAD_CONCURRENCY)
+
+    @classmethod
+    async def run(cls, func: Callable[..., Coroutine[Any, Any, _T]], *args: Any) -> _T:
+        """Run the upload, when there is a free slot. Raises `TimeoutError` after the timeout."""
+        cls._init()
+        start = time.perf_counter()
+        async with cls._semaphore:
+            metrics.observe("upload_pool.wait", time.perf_counter() - start)
+            cls._running += 1
+            try:
+                async with asyncio.timeout(constants.UPLOAD_TIMEOUT):
+                    return await func(*args)
+            finally:
+                cls._running -= 1
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        return {"running": cls._running}
+
+
+metrics.gauge("upload_pool", UploadPool.stats)
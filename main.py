@@ -1,13 +1,20 @@
 import logging
 import traceback
-import uuid
-
-import aiohttp as aiohttp
-from mongopersistence import MongoPersistence
-from telegram import InlineQueryResult, InlineQueryResultsButton, InlineQueryResultVideo, Update
-from telegram import Video as TelegramVideo
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aiohttp import ClientError
+from telegram import (
+    InlineQueryResult,
+    InlineQueryResultCachedVideo,
+    InlineQueryResultsButton,
+    InlineQueryResultVideo,
+    InputFile,
+    Message,
+    Update,
+)
 from telegram.constants import ChatType, MessageEntityType, ParseMode
-from telegram.error import BadRequest
+from telegram.error import BadRequest, NetworkError
 from telegram.ext import (
     Application,
     ChosenInlineResultHandler,
@@ -20,17 +27,50 @@ from telegram.ext import (
 
 from app import commands, constants, settings
 from app.context import CallbackContext
-from app.database import Reporter
+from app.database import Database, MediaCache, Persistence, Reporter, StorageUploader, TelegramFileCache
 from app.database.connector import MongoDatabase
 from app.models.medias import Media, MediaGroup, Video
 from app.models.report import Report, ReportPlace, ReportType
 from app.parsers import Parser
-from app.utils import a, patch
+from app.parsers.base import normalize_url
+from app.utils import (
+    HttpClient,
+    InlineAnswerCache,
+    InlineKind,
+    LatestTaskCoordinator,
+    UploadPool,
+    a,
+    inline_result_id,
+    metrics,
+    patch,
+)
 from app.utils.app_patchers.json_logger import env_wrapper
 from app.utils.i18n import _, _n
 
 logger = logging.getLogger(__name__)
 
+inline_coordinator = LatestTaskCoordinator("inline", delay=constants.INLINE_DEBOUNCE)
+
+
+async def _send_video(update: Update, media: Video, video: str | InputFile, caption: str, **kwargs: Any) -> Message:
+    return await update.effective_message.reply_video(
+        video=video,
+        caption=caption,
+        supports_streaming=True,
+        width=media.video_width,
+        height=media.video_height,
+        duration=media.video_duration,
+        **kwargs,
+    )
+
+
+async def _upload_video(update: Update, media: Video, caption: str) -> Message | None:
+    async with media.download() as file:
+        if file is None:
+            return None
+        # Default write timeout of PTB is too short to upload a large video
+        return await _send_video(update, media, media.file_input(file), caption, write_timeout=constants.UPLOAD_TIMEOUT)
+
 
 async def _process_video(update: Update, ctx: CallbackContext, media: Video) -> None:
     extra_caption = ""
@@ -43,38 +83,51 @@ async def _process_video(update: Update, ctx: CallbackContext, media: Video) ->
         ).format(url=media.max_quality_url)
 
     media_caption = (media.real_caption(ctx, "") + extra_caption).strip()
+    StorageUploader.hit(media)
 
-    try:
-        tg_video = ctx.tg_video_cache.get(media.original_url)
-        if tg_video:
-            tg_video = TelegramVideo.de_json(tg_video, ctx.bot)
-
-        res = await update.effective_message.reply_video(
-            video=(tg_video or media.file_input or media.url),
-            caption=media_caption,
-            supports_streaming=True,
-            width=media.video_width,
-            height=media.video_height,
-            duration=media.video_duration,
-        )
-        ctx.tg_video_cache[media.original_url] = res.video.to_dict()
-    except BadRequest as e:
-        logger.error(
-            "Error sending video: %s",
-            media.url,
-            exc_info=e,
-            stack_info=True,
+    # Cached file id, then Telegram downloads the URL, then the bot downloads and uploads the video
+    tg_video = await TelegramFileCache.get_video(ctx.bot.id, media.original_url)
+    stages: list[tuple[str, Callable[[], Awaitable[Message | None]]]] = [
+        ("url", lambda: _send_video(update, media, media.url, media_caption)),
+        ("upload", lambda: UploadPool.run(_upload_video, update, media, media_caption)),
+    ]
+    if tg_video:
+        stages.insert(0, ("file_id", lambda: _send_video(update, media, tg_video["file_id"], media_caption)))
+
+    error: Exception | None = None
+    for stage, send in stages:
+        try:
+            with metrics.timer(f"send_video.{stage}"):
+                res = await send()
+        except (NetworkError, TimeoutError, ClientError) as e:
+            # `NetworkError` includes `BadRequest` and `TimedOut`
+            logger.warning("Error sending video by %s: %s", stage, media.url, exc_info=e)
+            metrics.incr(f"send_video.{stage}.failed")
+            if stage == "file_id" and isinstance(e, BadRequest):
+                # File id is not valid anymore, so it's not used again
+                await TelegramFileCache.delete_video(ctx.bot.id, media.original_url)
+            error = e
+            continue
+        if res is None:
+            # Video is too large to upload
+            metrics.incr(f"send_video.{stage}.skipped")
+            continue
+        metrics.incr(f"send_video.{stage}.ok")
+        await TelegramFileCache.save_video(ctx.bot.id, media.original_url, res.video.to_dict())
+        return None
+
+    logger.error("Error sending video: %s", media.url, exc_info=error, stack_info=True)
+    if update.effective_chat.type == ChatType.PRIVATE:
+        logger.info("Sending video as link: %s", media)
+        await update.effective_message.reply_text(
+            _("Error sending video: {title}\n" "\n\n" '<a href="{url}">Direct link to video</a>').format(
+                title=a(media_caption, media.original_url),
+                url=media.url,
+            ),
         )
-        if update.effective_chat.type == ChatType.PRIVATE:
-            logger.info("Sending video as link: %s", media)
-            await update.effective_message.reply_text(
-                _("Error sending video: {title}\n" "\n\n" '<a href="{url}">Direct link to video</a>').format(
-                    title=a(media_caption, media.original_url),
-                    url=media.url,
-                ),
-            )
-            logger.info("Send video as link: %s", media.url)
-        raise e
+        logger.info("Send video as link: %s", media.url)
+    if error is not None:
+        raise error
 
 
 async def _process_media_group(update: Update, _: CallbackContext, media: MediaGroup) -> None:
@@ -104,8 +157,7 @@ async def link_parser(update: Update, ctx: CallbackContext) -> None:
     if not message_links:
         return None
 
-    async with aiohttp.ClientSession() as session:
-        medias: list[Media] = await Parser.parse(session, *message_links)
+    medias: list[Media] = await Parser.parse(HttpClient.session(), *message_links)
 
     for media in medias:
         if isinstance(media, Video):
@@ -134,15 +186,33 @@ def inline_query_description(video: Video) -> str:
 async def inline_query_video_from_media(
     medias: list[Media],
     ctx: CallbackContext,
-) -> list[InlineQueryResultVideo]:
-    def content(media: Video) -> InlineQueryResultVideo:
+) -> list[InlineQueryResultVideo | InlineQueryResultCachedVideo]:
+    indexes: dict[str, int] = {}
+
+    def content(media: Video) -> InlineQueryResultVideo | InlineQueryResultCachedVideo:
         c = media.caption
 
         if not c:
             c = _("{m_type} video").format(m_type=media.type.value)
 
+        # The same media has the same id, so answers cached by Telegram can be resolved later
+        index = indexes.get(media.original_url, 0)
+        indexes[media.original_url] = index + 1
+
+        # Video is already uploaded to Telegram, so it's sent without downloading it again.
+        # Only the first video of the link is saved to the cache
+        tg_video = tg_videos.get(media.original_url) if index == 0 else None
+        if tg_video and tg_video.get("file_id"):
+            return InlineQueryResultCachedVideo(
+                id=inline_result_id(media.original_url, index),
+                video_file_id=tg_video["file_id"],
+                title=c,
+                caption=media.real_caption(ctx),
+                description=inline_query_description(media),
+            )
+
         return InlineQueryResultVideo(
-            id=str(uuid.uuid4()),
+            id=inline_result_id(media.original_url, index),
             video_url=media.url,
             mime_type=media.mime_type,
             thumbnail_url=media.thumbnail_url or media.url,
@@ -154,20 +224,23 @@ async def inline_query_video_from_media(
             video_duration=media.video_duration,
         )
 
-    return [content(media) for media in medias if isinstance(media, Video)]
+    videos = [media for media in medias if isinstance(media, Video)]
+    tg_videos = await TelegramFileCache.get_videos(ctx.bot.id, [video.original_url for video in videos])
+    return [content(video) for video in videos]
 
 
 async def chosen_inline_query(update: Update, ctx: CallbackContext) -> None:
-    video = ctx.temp_history.pop(update.chosen_inline_result.result_id, None)
+    result_id = update.chosen_inline_result.result_id
+    # Answer could be cached by Telegram or by the bot, and then it's not in the user's temp history
+    video = ctx.temp_history.pop(result_id, None) or InlineAnswerCache.get_media(result_id)
     logger.info("Chosen video: %s", video)
     ctx.temp_history.clear()
 
     if not video or not ctx.settings.is_history_enabled(update):
         return None
 
-    if video not in ctx.history:
-        logger.info("Add %s video to history", video)
-        ctx.history.append(video)
+    logger.info("Add %s video to history", video["original_url"])
+    ctx.history.add(video["original_url"], video)
 
 
 async def inline_query(update: Update, ctx: CallbackContext) -> bool:
@@ -176,14 +249,35 @@ async def inline_query(update: Update, ctx: CallbackContext) -> bool:
     query = (update.inline_query.query or "").strip()
 
     async def send_history() -> bool:
+        policy = InlineAnswerCache.policy(InlineKind.HISTORY)
+        urls = ctx.history.urls()
+        # Media of the history is resolved from the cache with one query
+        cached = await MediaCache.get_many(urls)
+        missing = [url for url in urls if url not in cached]
+        tg_videos = await TelegramFileCache.get_videos(ctx.bot.id, missing) if missing else {}
+
+        medias: list[Media] = []
+        expired: list[str] = []
+        for url in urls:
+            info = ctx.history.info(url)
+            if url in cached:
+                medias.extend(cached[url])
+            elif url in tg_videos and info.get("type"):
+                # Media is expired, but the video is still in Telegram, so it's sent by its file id
+                medias.append(Video(**{k: v for k, v in info.items() if k != "@type"}, original_url=url, url=url))
+            else:
+                expired.append(url)
+        # Expired media is parsed again, so it's shown in the next answers
+        for url in expired[: constants.HISTORY_REFRESH_LIMIT]:
+            Parser.refresh_in_background(url)
         return await update.inline_query.answer(
-            await inline_query_video_from_media(ctx.history[::-1], ctx),
-            is_personal=True,
+            await inline_query_video_from_media(medias, ctx),
+            is_personal=policy.is_personal,
             button=InlineQueryResultsButton(
                 text=_("Recently added"),
                 start_parameter="help",
             ),
-            cache_time=1,
+            cache_time=policy.cache_time,
         )
 
     if not query:
@@ -195,56 +289,90 @@ async def inline_query(update: Update, ctx: CallbackContext) -> bool:
 
     not_found_text = _("No videos found. You don't think it's correct? Press here!")
 
-    async with aiohttp.ClientSession() as session:
-        medias: list[Media] = await Parser.parse(session, query)
-
-    logger.info("Medias: %s", medias)
-    if not medias:
+    async def send_not_found() -> bool:
         r = Report(
             report_type=ReportType.MEDIA_NOT_FOUND,
             message=query,
             report_place=ReportPlace.INLINE,
             extra_data=None,
         )
-        report_uid = await Reporter.save_report(r)
+        report_uid = Reporter.defer_report(r)
         logger.info("No medias found. Report: %s", r)
+        policy = InlineAnswerCache.policy(InlineKind.NOT_FOUND)
         return await update.inline_query.answer(
             [],
-            is_personal=True,
+            is_personal=policy.is_personal,
             button=InlineQueryResultsButton(
                 text=not_found_text,
                 start_parameter=f"report_{report_uid}",
             ),
-            cache_time=1,
+            cache_time=policy.cache_time,
         )
 
-    results: list[InlineQueryResult] = await inline_query_video_from_media(medias, ctx)
+    cache_key = (normalize_url(query), Media.caption_key(ctx))
+
+    async def build_results() -> list[InlineQueryResult] | None:
+        medias: list[Media] = await Parser.parse(HttpClient.session(), query)
+
+        logger.info("Medias: %s", medias)
+        if not medias:
+            return None
+
+        results: list[InlineQueryResult] = await inline_query_video_from_media(medias, ctx)
+        result_medias = {
+            iq_video.id: video.to_dict()
+            for video, iq_video in zip(filter(lambda x: isinstance(x, Video), medias), results)
+        }
+        if ctx.settings.is_history_enabled(update):
+            ctx.temp_history.update(result_medias)
+        InlineAnswerCache.set_results(InlineKind.LINK, cache_key, results, result_medias)
+        return results
+
+    async def send_medias() -> bool:
+        results = InlineAnswerCache.get_results(InlineKind.LINK, cache_key)
+        if results is not None:
+            metrics.incr("inline.cache_hit")
+            logger.info("Inline answer for %s is cached", query)
+        else:
+            results = await build_results()
+            if results is None:
+                return await send_not_found()
+        # Only the first video of the link is uploaded to the storage chat
+        first_video = InlineAnswerCache.get_media(results[0].id) if results else None
+        if first_video is not None:
+            StorageUploader.hit(Media.from_dict(first_video))
 
-    if ctx.settings.is_history_enabled(update):
-        for video, iq_video in zip(filter(lambda x: isinstance(x, Video), medias), results):
-            ctx.temp_history[iq_video.id] = video.to_dict()
-    r = Report(
-        report_type=ReportType.WRONG_MEDIA,
-        message=query,
-        report_place=ReportPlace.INLINE,
-        extra_data=None,
-    )
-    report_uid = await Reporter.save_report(r)
-    logger.info("Report for wrong media: %r", r)
-    return await update.inline_query.answer(
-        results,
-        is_personal=True,
-        button=InlineQueryResultsButton(
-            text=(
-                _n("Found %d video", "Found %d videos", len(results)) % len(results)
-                + _(". Is it correct media? Press here if not!")
-                if results
-                else not_found_text
+        r = Report(
+            report_type=ReportType.WRONG_MEDIA,
+            message=query,
+            report_place=ReportPlace.INLINE,
+            extra_data=None,
+        )
+        report_uid = Reporter.defer_report(r)
+        logger.info("Report for wrong media: %r", r)
+        policy = InlineAnswerCache.policy(InlineKind.LINK)
+        return await update.inline_query.answer(
+            results,
+            is_personal=policy.is_personal,
+            button=InlineQueryResultsButton(
+                text=(
+                    _n("Found %d video", "Found %d videos", len(results)) % len(results)
+                    + _(". Is it correct media? Press here if not!")
+                    if results
+                    else not_found_text
+                ),
+                start_parameter=f"report_{report_uid}",
             ),
-            start_parameter=f"report_{report_uid}",
-        ),
-        cache_time=1,
-    )
+            cache_time=policy.cache_time,
+        )
+
+    # Query is not a supported link (yet), so there is nothing to parse
+    if Parser.match(query) is None:
+        return await send_not_found()
+
+    # Only the latest query of the user is parsed, previous ones are cancelled
+    answer = await inline_coordinator.run(update.inline_query.from_user.id, send_medias)
+    return bool(answer)
 
 
 @env_wrapper
@@ -256,32 +384,36 @@ async def error(update: Update, context: CallbackContext) -> None:
 
 
 async def post_init(app: Application) -> None:
-    __ = app
-    MongoDatabase.init()
+    await Database.init()
+    # Other caches are in MongoDB, if it's set
+    await MongoDatabase.init()
+    await TelegramFileCache.migrate(app.bot.id, app.bot_data)
+    await HttpClient.init()
+    await StorageUploader.start(app)
+    metrics.start_logging(constants.METRICS_LOG_INTERVAL, logger)
 
 
 async def post_shutdown(app: Application) -> None:
     __ = app
-    try:
-        MongoDatabase.close()
-    except AttributeError:
-        pass
+    await metrics.stop_logging()
+    metrics.log(logger)
+    await StorageUploader.stop()
+    await MediaCache.flush(wait=True)
+    await TelegramFileCache.flush(wait=True)
+    await MongoDatabase.wait_writes()
+    Parser.close()
+    await HttpClient.close()
+    Database.close()
+    MongoDatabase.close()
 
 
 def main() -> None:
     """Start the bot."""
     logger.debug("Token: %r", constants.TOKEN)
 
-    persistence: MongoPersistence[dict, dict, dict] = MongoPersistence(
-        mongo_url=constants.MONGO_URL,
-        db_name=constants.MONGO_DB,
-        name_col_user_data="user-data",
-        name_col_chat_data="chat-data",
-        name_col_bot_data="bot-data",
-        name_col_conversations_data="conversations-data",
-        create_col_if_not_exist=True,
-        load_on_flush=False,
-        update_interval=30,
+    persistence = Persistence(
+        update_interval=constants.PERSISTENCE_UPDATE_INTERVAL,
+        idle_ttl=constants.PERSISTENCE_IDLE_TTL,
     )
     defaults = Defaults(
         parse_mode=ParseMode.HTML,
@@ -302,7 +434,8 @@ def main() -> None:
         [
             ChosenInlineResultHandler(chosen_inline_query),
             settings.callback_handler(),
-            InlineQueryHandler(inline_query),
+            # Not blocking, so a newer query of the user can cancel the previous one
+            InlineQueryHandler(inline_query, block=False),
             MessageHandler(filters.TEXT & ~filters.COMMAND, link_parser),
         ]
     )
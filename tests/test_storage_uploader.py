@@ -0,0 +1,138 @@
+import io
+import os
+import unittest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("TG_TOKEN", "test")
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+
+import telegram
+from telegram.error import BadRequest
+
+from app import constants
+from app.database import StorageUploader, TelegramFileCache
+from app.models.medias import Media, ParserType, Video
+
+STORAGE_CHAT_ID = -100
+
+
+class FakeBot:
+    """Bot API, that records sent videos and can't download videos by URL if `fail_url` is set."""
+
+    id = 42
+
+    def __init__(self, fail_url: bool = False) -> None:
+        self.fail_url = fail_url
+        self.sent: list[tuple[object, dict]] = []
+
+    async def send_video(self, video: object, **kwargs) -> SimpleNamespace:
+        self.sent.append((video, kwargs))
+        if self.fail_url and isinstance(video, str):
+            raise BadRequest("Wrong file identifier/http url specified")
+        file_id = f"file-{len(self.sent)}"
+        return SimpleNamespace(video=telegram.Video(file_id, f"unique-{file_id}", width=1, height=1, duration=1))
+
+
+@asynccontextmanager
+async def fake_download(self: Video, user_agent: str | None = None):
+    yield io.BytesIO(b"video")
+
+
+def make_video(n: int = 1) -> Video:
+    return Video(
+        type=ParserType.TIKTOK,
+        original_url=f"https://www.tiktok.com/@author/video/{n}",
+        url=f"https://cdn.example.com/{n}.mp4",
+        caption="",
+    )
+
+
+class StorageUploaderTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        patches = [
+            mock.patch.object(constants, "STORAGE_CHAT_ID", STORAGE_CHAT_ID),
+            mock.patch.object(constants, "STORAGE_UPLOAD_THRESHOLD", 2),
+            mock.patch.object(constants, "STORAGE_UPLOAD_RATE", 0),
+            mock.patch.object(Video, "download", fake_download),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        TelegramFileCache.memory.clear()
+        StorageUploader._hits.clear()
+
+    async def asyncTearDown(self) -> None:
+        await StorageUploader.stop()
+
+    async def start(self, bot: FakeBot) -> None:
+        await StorageUploader.start(SimpleNamespace(bot=bot))
+
+    async def test_uploads_popular_video_by_url(self) -> None:
+        bot = FakeBot()
+        await self.start(bot)
+        video = make_video()
+
+        StorageUploader.hit(video)
+        await StorageUploader._queue.join()
+        self.assertEqual(bot.sent, [])
+
+        StorageUploader.hit(video)
+        await StorageUploader._queue.join()
+        self.assertEqual(len(bot.sent), 1)
+        sent, kwargs = bot.sent[0]
+        self.assertEqual(sent, video.url)
+        self.assertEqual(kwargs["chat_id"], STORAGE_CHAT_ID)
+        saved = await TelegramFileCache.get_video(bot.id, video.original_url)
+        self.assertEqual(saved["file_id"], "file-1")
+
+    async def test_uploads_file_when_telegram_cant_download_url(self) -> None:
+        bot = FakeBot(fail_url=True)
+        await self.start(bot)
+        video = make_video()
+
+        StorageUploader.hit(video)
+        StorageUploader.hit(video)
+        await StorageUploader._queue.join()
+
+        self.assertEqual(len(bot.sent), 2)
+        self.assertIsInstance(bot.sent[1][0], telegram.InputFile)
+        self.assertEqual(bot.sent[1][1]["write_timeout"], constants.UPLOAD_TIMEOUT)
+        saved = await TelegramFileCache.get_video(bot.id, video.original_url)
+        self.assertEqual(saved["file_id"], "file-2")
+
+    async def test_skips_known_video(self) -> None:
+        bot = FakeBot()
+        await self.start(bot)
+        video = make_video()
+        await TelegramFileCache.save_video(bot.id, video.original_url, {"file_id": "known"})
+
+        StorageUploader.hit(video)
+        StorageUploader.hit(video)
+        await StorageUploader._queue.join()
+
+        self.assertEqual(bot.sent, [])
+
+    async def test_counts_video_from_cached_dict(self) -> None:
+        bot = FakeBot()
+        await self.start(bot)
+        video = make_video()
+        cached = video.to_dict()
+
+        StorageUploader.hit(Media.from_dict(cached))
+        StorageUploader.hit(Media.from_dict(cached))
+        await StorageUploader._queue.join()
+
+        self.assertEqual(len(bot.sent), 1)
+        self.assertIn("@type", cached)
+
+    async def test_disabled_without_storage_chat(self) -> None:
+        with mock.patch.object(constants, "STORAGE_CHAT_ID", None):
+            await self.start(FakeBot())
+        self.assertFalse(StorageUploader.enabled())
+        StorageUploader.hit(make_video())
+
+
+if __name__ == "__main__":
+    unittest.main()